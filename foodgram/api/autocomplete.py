@@ -0,0 +1,119 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from django.conf import settings
+
+from recipes.models import Ingredient
+
+
+def trigrams(text, finished=True):
+    """Триграммы в духе pg_trgm: каждое слово дополняется пробелами.
+    У недописанного последнего слова (finished=False) конец не
+    дополняется, чтобы оно совпадало как префикс."""
+    words = text.split()
+    result = set()
+    for index, word in enumerate(words):
+        tail = ' ' if finished or index < len(words) - 1 else ''
+        padded = f'  {word}{tail}'
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def distance(first, second, limit):
+    """Расстояние Левенштейна; всё, что больше limit, равно limit + 1."""
+    previous = list(range(len(second) + 1))
+    for i, left in enumerate(first, 1):
+        current = [i]
+        for j, right in enumerate(second, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (left != right)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return min(previous[-1], limit + 1)
+
+
+def prefix_distance(term, name, limit):
+    """Расстояние от term до начала названия и, с единичным штрафом
+    за позицию, до начала любого другого слова названия."""
+    best = distance(term, name[:len(term)], limit)
+    for word in name.split()[1:]:
+        if best == 0:
+            break
+        best = min(best, distance(term, word[:len(term)], limit) + 0.5)
+    return best
+
+
+class IngredientIndex:
+    """Индекс ингредиентов в памяти процесса для автодополнения.
+
+    Сначала отдаются совпадения по началу названия (поиск бисекцией
+    в отсортированном списке). Затем кандидаты, найденные по общим
+    триграммам, ранжируются по расстоянию до начала названия или
+    одного из его слов: так прощаются опечатки и находятся слова
+    в середине названия.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.state = None
+
+    def invalidate(self):
+        self.state = None
+
+    def load(self):
+        ingredients = sorted(Ingredient.objects.all(),
+                             key=lambda item: (item.name.casefold(), item.id))
+        keys = [item.name.casefold() for item in ingredients]
+        postings = defaultdict(list)
+        for position, key in enumerate(keys):
+            for trigram in trigrams(key):
+                postings[trigram].append(position)
+        return time.monotonic(), ingredients, keys, dict(postings)
+
+    def get_state(self):
+        state = self.state
+        if state is None or time.monotonic() - state[0] > self.ttl:
+            with self.lock:
+                state = self.state
+                if state is None or time.monotonic() - state[0] > self.ttl:
+                    state = self.state = self.load()
+        return state
+
+    def search(self, term, limit):
+        _, ingredients, keys, postings = self.get_state()
+        term = ' '.join(term.casefold().split())
+        if not term:
+            return []
+        found = []
+        position = bisect_left(keys, term)
+        while (position < len(keys) and len(found) < limit
+               and keys[position].startswith(term)):
+            found.append(position)
+            position += 1
+        if len(found) < limit:
+            # Короткие запросы ищутся только без опечаток: одна ошибка
+            # в двух-трёх буквах подходит почти к любому названию.
+            max_distance = len(term) // 4
+            query = trigrams(term, finished=False)
+            # Одна опечатка портит не больше трёх триграмм.
+            threshold = max(2, len(query) - 3 * max_distance)
+            counts = Counter(
+                position for trigram in query
+                for position in postings.get(trigram, ()))
+            seen = set(found)
+            fuzzy = []
+            for position, count in counts.items():
+                if count < threshold or position in seen:
+                    continue
+                score = prefix_distance(term, keys[position], max_distance)
+                if score <= max_distance + 0.5:
+                    fuzzy.append((score, position))
+            found.extend(position for _, position in sorted(fuzzy))
+        return [ingredients[position] for position in found[:limit]]
+
+
+ingredient_index = IngredientIndex(settings.INGREDIENT_INDEX_TTL)
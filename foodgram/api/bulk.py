@@ -0,0 +1,177 @@
+from django.core.exceptions import EmptyResultSet
+from django.db import connections, router, transaction
+from django.db.models import F
+from django.db.models.sql import InsertQuery
+
+from recipes.models import Favorites, Recipe, ShoppingCart, ShoppingListItem
+from users.models import CustomUser, Follow
+from .cache import invalidate
+from .feed import drop_timeline
+
+# Связь пользователя с объектом: внешний ключ на объект, модель объекта
+# и счётчик в ней.
+RELATIONS = {
+    Favorites: ('recipe', Recipe, 'favorites_count'),
+    ShoppingCart: ('recipe', Recipe, 'in_carts_count'),
+    Follow: ('author', CustomUser, 'followers_count'),
+}
+
+
+def insert_ignore(model, objs, returning):
+    """Вставляет строки одним INSERT ... ON CONFLICT DO NOTHING.
+
+    Строки, которые нарушили бы уникальное ограничение, пропускаются,
+    и возвращаются значения поля returning только у вставленных строк.
+    Без RETURNING в СУБД строки вставляются по одной и вставленные
+    определяются по числу затронутых строк.
+    """
+    objs = list(objs)
+    if not objs:
+        return []
+    using = router.db_for_write(model)
+    connection = connections[using]
+    field = model._meta.get_field(returning)
+    fields = [item for item in model._meta.local_concrete_fields
+              if not item.primary_key]
+    inserted = []
+    with connection.cursor() as cursor:
+        if connection.features.can_return_rows_from_bulk_insert:
+            batches = [objs]
+        else:
+            batches = [[obj] for obj in objs]
+        for batch in batches:
+            query = InsertQuery(model, ignore_conflicts=True)
+            query.insert_values(fields, batch)
+            compiler = query.get_compiler(using)
+            if connection.features.can_return_rows_from_bulk_insert:
+                compiler.returning_fields = [field]
+            for sql, params in compiler.as_sql():
+                cursor.execute(sql, params)
+                if compiler.returning_fields:
+                    inserted.extend(row[0] for row in cursor.fetchall())
+                elif cursor.rowcount:
+                    inserted.append(field.value_from_object(batch[0]))
+    return inserted
+
+
+def delete_returning(queryset, returning):
+    """Удаляет строки одним DELETE ... RETURNING, без выборки строк
+    и сигналов на каждую, и возвращает значения поля returning у строк,
+    которые удалил именно этот запрос.
+
+    Без RETURNING в СУБД строки перед удалением блокируются и удаляются
+    по первичным ключам.
+    """
+    connection = connections[queryset.db]
+    meta = queryset.model._meta
+    quote = connection.ops.quote_name
+    table = quote(meta.db_table)
+    pk = quote(meta.pk.column)
+    if not connection.features.can_return_columns_from_insert:
+        rows = list(queryset.select_for_update().values_list(
+            'pk', returning))
+        if not rows:
+            return []
+        placeholders = ', '.join(['%s'] * len(rows))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {table} WHERE {pk} IN ({placeholders})',
+                [row[0] for row in rows])
+        return [row[1] for row in rows]
+    try:
+        sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    except EmptyResultSet:
+        return []
+    column = quote(meta.get_field(returning).column)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE {pk} IN ({sql}) RETURNING {column}',
+            params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def apply_changes(model, user_id, ids, delta):
+    """Делает за один раз то, что сигналы делают для каждой строки:
+    вставка и удаление здесь идут в обход сигналов."""
+    _, target, counter = RELATIONS[model]
+    target.objects.filter(id__in=ids).update(
+        **{counter: F(counter) + delta})
+    if model is ShoppingCart:
+        ShoppingListItem.objects.apply_recipes(ids, delta, [user_id])
+    if model is Follow:
+        transaction.on_commit(lambda: drop_timeline(user_id))
+    invalidate(f'user:{user_id}')
+
+
+def add_relations(model, user_id, ids):
+    """Связывает пользователя с объектами ids и возвращает id тех,
+    что связаны этим вызовом: уже существующие связи не трогаются,
+    и одновременные запросы не могут добавить одну связь дважды."""
+    field, _, _ = RELATIONS[model]
+    with transaction.atomic():
+        added = insert_ignore(
+            model,
+            (model(user_id=user_id, **{f'{field}_id': object_id})
+             for object_id in ids),
+            f'{field}_id')
+        if added:
+            apply_changes(model, user_id, added, 1)
+    return added
+
+
+def remove_relations(model, user_id, ids=None):
+    """Удаляет связи пользователя с объектами ids, без ids — все,
+    и возвращает id удалённых этим вызовом: параллельный запрос
+    не получит те же id, и счётчики не уменьшатся дважды."""
+    field, _, _ = RELATIONS[model]
+    with transaction.atomic():
+        rows = model.objects.filter(user_id=user_id)
+        if ids is not None:
+            rows = rows.filter(**{f'{field}_id__in': ids})
+        removed = delete_returning(rows, f'{field}_id')
+        if removed:
+            apply_changes(model, user_id, removed, -1)
+    return removed
+
+
+def bulk_add(model, user_id, ids):
+    """Добавляет связи пользователя с объектами ids.
+
+    Возвращает статус для каждого id: added, exists, not_found
+    или self (подписка на себя).
+    """
+    _, target, _ = RELATIONS[model]
+    ids = list(dict.fromkeys(ids))
+    found = set(target.objects.filter(
+        id__in=ids).values_list('id', flat=True))
+    if model is Follow:
+        found.discard(user_id)
+    added = set(add_relations(
+        model, user_id, [object_id for object_id in ids
+                         if object_id in found]))
+    statuses = {}
+    for object_id in ids:
+        if object_id in added:
+            statuses[object_id] = 'added'
+        elif object_id in found:
+            statuses[object_id] = 'exists'
+        elif model is Follow and object_id == user_id:
+            statuses[object_id] = 'self'
+        else:
+            statuses[object_id] = 'not_found'
+    return statuses
+
+
+def bulk_remove(model, user_id, ids=None):
+    """Удаляет связи пользователя с объектами ids, без ids — все.
+
+    Возвращает статус для каждого id: removed или missing.
+    """
+    if ids is not None:
+        ids = list(dict.fromkeys(ids))
+    removed = remove_relations(model, user_id, ids)
+    if ids is None:
+        ids = removed
+    removed = set(removed)
+    return {object_id: 'removed' if object_id in removed else 'missing'
+            for object_id in ids}
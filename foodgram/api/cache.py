@@ -0,0 +1,131 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework import status
+from rest_framework.response import Response
+
+# Заголовки, которые сохраняются в кеше вместе с данными ответа.
+CACHED_HEADERS = ('Cache-Control',)
+
+
+def get_version(namespace):
+    """Версия пространства имён кеша: время последнего изменения данных
+    в наносекундах. Если версия вытеснена из кеша, она начинается
+    заново с текущего момента и не совпадёт ни с одной старой."""
+    key = f'version:{namespace}'
+    now = time.time_ns()
+    cache.add(key, now, timeout=None)
+    return cache.get(key, now)
+
+
+def bump_version(namespace):
+    cache.set(f'version:{namespace}', time.time_ns(), timeout=None)
+
+
+def invalidate(*namespaces):
+    """Сбрасывает кеш после фиксации транзакции, чтобы в кеш не попали
+    данные, которые ещё не видны другим соединениям."""
+    def bump():
+        for namespace in namespaces:
+            bump_version(namespace)
+    transaction.on_commit(bump)
+
+
+def record(namespace, event):
+    key = f'stats:{namespace}:{event}'
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+def get_stats(namespaces):
+    return {namespace: {event: cache.get(f'stats:{namespace}:{event}', 0)
+                        for event in ('hit', 'miss')}
+            for namespace in namespaces}
+
+
+def response_cache_key(namespace, request):
+    query = sorted(request.query_params.lists())
+    raw = f'{request.get_host()}{request.path}{query}'
+    digest = hashlib.md5(raw.encode()).hexdigest()
+    return f'response:{namespace}:{get_version(namespace)}:{digest}'
+
+
+def cache_response(namespace, anonymous_only=False):
+    """Кеширует data и CACHED_HEADERS успешного ответа метода view."""
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            if not settings.SHARED_CACHE or (
+                    anonymous_only and request.user.is_authenticated):
+                return method(self, request, *args, **kwargs)
+            key = response_cache_key(namespace, request)
+            cached = cache.get(key)
+            if cached is not None:
+                record(namespace, 'hit')
+                data, headers = cached
+                return Response(data, headers={**headers, 'X-Cache': 'HIT'})
+            record(namespace, 'miss')
+            response = method(self, request, *args, **kwargs)
+            if response.status_code == 200:
+                headers = {name: response[name] for name in CACHED_HEADERS
+                           if response.has_header(name)}
+                cache.set(key, (response.data, headers),
+                          settings.RESPONSE_CACHE_TIMEOUT)
+            response['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
+
+
+def conditional_response(*namespaces, per_user=False):
+    """Отдаёт ETag и Last-Modified по версиям данных и отвечает 304
+    до запуска view, если у клиента актуальная копия.
+
+    С per_user в версию входят избранное, корзина и подписки
+    пользователя, от которых зависят флаги в ответе.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            if not settings.CONDITIONAL_GET:
+                return method(self, request, *args, **kwargs)
+            user_id = request.user.id if per_user else None
+            versions = [get_version(namespace) for namespace in namespaces]
+            if user_id is not None:
+                versions.append(get_version(f'user:{user_id}'))
+            raw = (f'{request.get_host()}{request.path}'
+                   f'{sorted(request.query_params.lists())}'
+                   f'{user_id}{versions}')
+            etag = f'"{hashlib.md5(raw.encode()).hexdigest()}"'
+            last_modified = max(versions) // 10 ** 9
+            if_none_match = request.headers.get('If-None-Match')
+            if_modified_since = parse_http_date_safe(
+                request.headers.get('If-Modified-Since'))
+            if if_none_match is not None:
+                not_modified = etag in (
+                    tag.strip() for tag in if_none_match.split(','))
+            else:
+                not_modified = (if_modified_since is not None
+                                and last_modified <= if_modified_since)
+            if not_modified:
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            else:
+                response = method(self, request, *args, **kwargs)
+            if response.status_code in (status.HTTP_200_OK,
+                                        status.HTTP_304_NOT_MODIFIED):
+                response['ETag'] = etag
+                response['Last-Modified'] = http_date(last_modified)
+                if per_user:
+                    patch_vary_headers(response, ('Authorization',))
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,85 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+from recipes.models import Recipe
+from users.models import CustomUser, Follow
+
+
+def feed_key(user_id):
+    return f'feed:{user_id}'
+
+
+def popular_authors(user_id):
+    """Авторы из подписок, чьи рецепты не раскладываются по лентам."""
+    return Follow.objects.filter(
+        user_id=user_id,
+        author__followers_count__gt=settings.FEED_FANOUT_MAX_FOLLOWERS,
+    ).values('author')
+
+
+def build_timeline(user_id):
+    """Лента из БД: id последних FEED_SIZE рецептов авторов из подписок,
+    кроме популярных, и список этих популярных авторов."""
+    pulled = [row['author'] for row in popular_authors(user_id)]
+    ids = Recipe.objects.filter(
+        author__in=Follow.objects.filter(user_id=user_id).exclude(
+            author_id__in=pulled).values('author'),
+    ).order_by('-id').values_list('id', flat=True)[:settings.FEED_SIZE]
+    return {'ids': list(ids), 'pulled': pulled}
+
+
+def get_timeline(user_id):
+    if not settings.SHARED_CACHE:
+        return build_timeline(user_id)
+    key = feed_key(user_id)
+    timeline = cache.get(key)
+    if timeline is None:
+        timeline = build_timeline(user_id)
+        cache.set(key, timeline, settings.FEED_TIMEOUT)
+    return timeline
+
+
+def fan_out(recipe_id, author_id):
+    """Добавляет новый рецепт в ленты подписчиков автора, которые
+    уже лежат в кеше; остальные ленты соберутся из БД при чтении.
+
+    Рецепты популярных авторов не раскладываются: запись в тысячи лент
+    дороже, чем один запрос по индексу (author, -id) при чтении.
+    Одновременные записи в одну ленту могут потерять рецепт; лента
+    пересобирается не позже чем через FEED_TIMEOUT.
+    """
+    if not settings.SHARED_CACHE:
+        return
+    followers_count = CustomUser.objects.filter(pk=author_id).values_list(
+        'followers_count', flat=True).first()
+    if not followers_count or (
+            followers_count > settings.FEED_FANOUT_MAX_FOLLOWERS):
+        return
+    keys = [feed_key(user_id) for user_id in Follow.objects.filter(
+        author_id=author_id).values_list('user_id', flat=True)]
+    timelines = cache.get_many(keys)
+    for timeline in timelines.values():
+        if recipe_id not in timeline['ids']:
+            timeline['ids'] = sorted(
+                [recipe_id, *timeline['ids']],
+                reverse=True)[:settings.FEED_SIZE]
+    cache.set_many(timelines, settings.FEED_TIMEOUT)
+
+
+def drop_timeline(user_id):
+    cache.delete(feed_key(user_id))
+
+
+def feed_queryset(queryset, user_id):
+    """Рецепты ленты пользователя: из сохранённой ленты, популярных
+    авторов из подписок и, если лента заполнена целиком, более старые
+    рецепты всех авторов из подписок прямо из БД."""
+    timeline = get_timeline(user_id)
+    condition = (Q(id__in=timeline['ids'])
+                 | Q(author_id__in=timeline['pulled'])
+                 | Q(author__in=popular_authors(user_id)))
+    if len(timeline['ids']) >= settings.FEED_SIZE:
+        following = Follow.objects.filter(user_id=user_id).values('author')
+        condition |= Q(id__lt=timeline['ids'][-1], author__in=following)
+    return queryset.filter(condition)
@@ -1,8 +1,27 @@
 import django_filters
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Exists, OuterRef
 from rest_framework import filters
 
-from recipes.models import Recipe
+from recipes.models import Favorites, Recipe, ShoppingCart, Tag, TagRecipe
 from users.models import CustomUser
+from .cache import get_version
+
+TAGS_MODES = (('any', 'Любой из тегов'), ('all', 'Все теги'))
+
+
+def get_tag_ids():
+    """Словарь slug -> id тегов из кеша; сбрасывается вместе с версией
+    пространства имён tags."""
+    if not settings.SHARED_CACHE:
+        return dict(Tag.objects.values_list('slug', 'id'))
+    key = f'tag_ids:{get_version("tags")}'
+    tag_ids = cache.get(key)
+    if tag_ids is None:
+        tag_ids = dict(Tag.objects.values_list('slug', 'id'))
+        cache.set(key, tag_ids, settings.RESPONSE_CACHE_TIMEOUT)
+    return tag_ids
 
 
 class IngredientSearchFilter(filters.SearchFilter):
@@ -12,21 +31,56 @@ class IngredientSearchFilter(filters.SearchFilter):
 class RecipeFilters(django_filters.FilterSet):
     author = django_filters.ModelChoiceFilter(
         queryset=CustomUser.objects.all())
-    tags = django_filters.AllValuesMultipleFilter(field_name='tags__slug')
+    tags = django_filters.MultipleChoiceFilter(
+        choices=lambda: [(slug, slug) for slug in get_tag_ids()],
+        method='get_tags')
+    tags_mode = django_filters.ChoiceFilter(
+        choices=TAGS_MODES, method='get_tags_mode')
+    search = django_filters.CharFilter(method='get_search')
     is_favorited = django_filters.NumberFilter(method='get_is_favorited')
     is_in_shopping_cart = django_filters.NumberFilter(
         method='get_is_in_shopping_cart')
 
     class Meta:
         model = Recipe
-        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart')
+        fields = ('author', 'tags', 'tags_mode', 'search', 'is_favorited',
+                  'is_in_shopping_cart')
+
+    def get_tags(self, queryset, name, value):
+        """Без JOIN с тегами: рецепт попадает в выдачу один раз и
+        DISTINCT не нужен. По умолчанию подходит любой из тегов,
+        с tags_mode=all — только рецепты со всеми тегами."""
+        if not value:
+            return queryset
+        tag_ids = get_tag_ids()
+        ids = {tag_ids[slug] for slug in value}
+        if self.form.cleaned_data.get('tags_mode') == 'all':
+            return queryset.filter(id__in=TagRecipe.objects.filter(
+                tag_id__in=ids).values('recipe').annotate(
+                tags_count=Count('tag')).filter(
+                tags_count=len(ids)).values('recipe'))
+        return queryset.filter(Exists(TagRecipe.objects.filter(
+            recipe=OuterRef('pk'), tag_id__in=ids)))
+
+    def get_tags_mode(self, queryset, name, value):
+        # Учитывается в get_tags.
+        return queryset
+
+    def get_search(self, queryset, name, value):
+        return queryset.search(value)
 
     def get_is_favorited(self, queryset, name, value):
+        if value and self.request.user.is_authenticated:
+            return queryset.filter(Exists(Favorites.objects.filter(
+                user=self.request.user, recipe=OuterRef('pk'))))
         if value:
-            return queryset.filter(favorites__user=self.request.user)
+            return queryset.none()
         return queryset
 
     def get_is_in_shopping_cart(self, queryset, name, value):
+        if value and self.request.user.is_authenticated:
+            return queryset.filter(Exists(ShoppingCart.objects.filter(
+                user=self.request.user, recipe=OuterRef('pk'))))
         if value:
-            return queryset.filter(shopping_cart__user=self.request.user)
+            return queryset.none()
         return queryset.all()
@@ -0,0 +1,163 @@
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, connection, transaction
+from PIL import Image, ImageOps
+
+from recipes.models import Recipe
+from .cache import invalidate
+
+logger = logging.getLogger('foodgram.images')
+
+# Форматы копий: формат Pillow, расширение файла и параметры сохранения.
+VARIANT_FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True,
+                             'progressive': True}),
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.IMAGE_WORKERS,
+                    thread_name_prefix='recipe-images')
+    return _executor
+
+
+def open_image(file, max_width):
+    """Открывает картинку, не распаковывая больше, чем нужно.
+
+    Размер проверяется по заголовку до декодирования, а JPEG
+    распаковывается сразу в уменьшенном масштабе (draft), поэтому
+    память не зависит от разрешения исходника.
+    """
+    image = Image.open(file)
+    if image.width * image.height > settings.IMAGE_MAX_PIXELS:
+        raise ValueError(f'Слишком большая картинка: {image.size}')
+    image.draft('RGB', (max_width, max_width))
+    image = ImageOps.exif_transpose(image)
+    has_alpha = image.mode in ('RGBA', 'LA') or (
+        image.mode == 'P' and 'transparency' in image.info)
+    return image.convert('RGBA' if has_alpha else 'RGB')
+
+
+def encode(image, pillow_format, options):
+    if pillow_format == 'JPEG' and image.mode == 'RGBA':
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    buffer = io.BytesIO()
+    image.save(buffer, pillow_format, **options)
+    return buffer.getvalue()
+
+
+def build_variants(name):
+    """Сохраняет уменьшенные копии картинки во всех форматах.
+
+    Возвращает {'webp': {'320': путь, ...}, 'jpeg': {...}}. Копии шире
+    исходника не делаются: вместо них одна копия в исходную ширину.
+    """
+    widths = sorted(settings.RECIPE_IMAGE_WIDTHS, reverse=True)
+    stem = os.path.splitext(os.path.basename(name))[0]
+    variants = {key: {} for key in VARIANT_FORMATS}
+    with default_storage.open(name) as file:
+        image = open_image(file, widths[0])
+    for width in widths:
+        if width < image.width:
+            # Каждая копия уменьшается из предыдущей, а не из исходника.
+            image = image.resize(
+                (width, max(1, round(image.height * width / image.width))),
+                Image.LANCZOS)
+        width = str(image.width)
+        if width in variants['webp']:
+            continue
+        for key, (pillow_format, extension, options) in (
+                VARIANT_FORMATS.items()):
+            path = f'foodgram/variants/{stem}_{width}.{extension}'
+            if default_storage.exists(path):
+                default_storage.delete(path)
+            variants[key][width] = default_storage.save(
+                path, ContentFile(encode(image, pillow_format, options)))
+    return variants
+
+
+def delete_variants(variants):
+    """Удаляет файлы копий после фиксации транзакции, в которой рецепт
+    перестал на них ссылаться."""
+    paths = [path for paths in variants.values() for path in paths.values()]
+
+    def delete():
+        for path in paths:
+            default_storage.delete(path)
+    if paths:
+        transaction.on_commit(delete)
+
+
+def process_recipe_image(recipe_id, name):
+    """Строит копии картинки и сохраняет их в рецепт, если картинка
+    за это время не сменилась; иначе копии удаляются."""
+    try:
+        variants = build_variants(name)
+    except (OSError, ValueError, Image.DecompressionBombError) as error:
+        logger.warning('Не удалось обработать картинку %s: %s', name, error)
+        return False
+    updated = Recipe.objects.filter(pk=recipe_id, image=name).update(
+        image_variants=variants)
+    if updated:
+        invalidate('recipes')
+    else:
+        delete_variants(variants)
+    return bool(updated)
+
+
+def run_in_worker(recipe_id, name):
+    close_old_connections()
+    try:
+        process_recipe_image(recipe_id, name)
+    except Exception:
+        logger.exception('Ошибка обработки картинки рецепта %s', recipe_id)
+    finally:
+        connection.close()
+
+
+def schedule_image_processing(recipe):
+    """После фиксации транзакции отдаёт обработку картинки в пул потоков.
+
+    Pillow отпускает GIL при распаковке, масштабировании и сжатии,
+    поэтому потоки пула не держат обработчики запросов.
+    """
+    recipe_id, name = recipe.pk, recipe.image.name
+
+    def submit():
+        if settings.IMAGE_WORKERS:
+            get_executor().submit(run_in_worker, recipe_id, name)
+        else:
+            process_recipe_image(recipe_id, name)
+    transaction.on_commit(submit)
+
+
+def variant_urls(variants, request=None):
+    """Адреса копий по форматам, от узкой к широкой: [{width, url}]."""
+    result = {}
+    for key, paths in variants.items():
+        urls = []
+        for width in sorted(paths, key=int):
+            url = default_storage.url(paths[width])
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            urls.append({'width': int(width), 'url': url})
+        result[key] = urls
+    return result
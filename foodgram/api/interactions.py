@@ -0,0 +1,56 @@
+from array import array
+
+from django.conf import settings
+from django.core.cache import cache
+
+from recipes.models import Favorites, ShoppingCart
+from users.models import Follow
+from .cache import get_version
+
+
+class Interactions:
+    """Id рецептов в избранном и в корзине пользователя и id авторов,
+    на которых он подписан."""
+    __slots__ = ('favorites', 'cart', 'following')
+
+    def __init__(self, favorites=(), cart=(), following=()):
+        self.favorites = frozenset(favorites)
+        self.cart = frozenset(cart)
+        self.following = frozenset(following)
+
+
+NO_INTERACTIONS = Interactions()
+
+
+def load_interactions(user_id):
+    """Загружает наборы id тремя запросами или берёт их из кеша.
+
+    В кеше наборы лежат отсортированными массивами array('q'), ключ
+    включает версию user:<id>, которую сигналы меняют при изменении
+    избранного, корзины и подписок, поэтому старые наборы не читаются.
+    """
+    key = f'interactions:{user_id}:{get_version(f"user:{user_id}")}'
+    rows = cache.get(key) if settings.SHARED_CACHE else None
+    if rows is None:
+        rows = tuple(
+            array('q', sorted(queryset.values_list(field, flat=True)))
+            for queryset, field in (
+                (Favorites.objects.filter(user_id=user_id), 'recipe_id'),
+                (ShoppingCart.objects.filter(user_id=user_id), 'recipe_id'),
+                (Follow.objects.filter(user_id=user_id), 'author_id'),
+            ))
+        if settings.SHARED_CACHE:
+            cache.set(key, rows, settings.RESPONSE_CACHE_TIMEOUT)
+    return Interactions(*rows)
+
+
+def get_interactions(request):
+    """Наборы текущего пользователя, загруженные один раз за запрос
+    и общие для всех сериализаторов ответа."""
+    if request is None or not request.user.is_authenticated:
+        return NO_INTERACTIONS
+    interactions = getattr(request, '_interactions', None)
+    if interactions is None:
+        interactions = request._interactions = load_interactions(
+            request.user.id)
+    return interactions
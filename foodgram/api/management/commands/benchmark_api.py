@@ -0,0 +1,172 @@
+import statistics
+import time
+
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from api.seed import SeedCommand
+from recipes.models import Recipe
+from users.models import CustomUser
+
+# Эндпоинты, где число запросов не должно зависеть от размера страницы.
+SCALED = (
+    ('recipes list', '/api/recipes/?limit={limit}', False),
+    ('recipes list (anonymous)', '/api/recipes/?limit={limit}', True),
+    ('recipes list (card)', '/api/recipes/?limit={limit}&fields=id,name,'
+                            'image,cooking_time,author,tags,is_favorited,'
+                            'is_in_shopping_cart&expand=author,tags', False),
+    ('recipes list (cursor)', '/api/recipes/?pagination=cursor'
+                              '&limit={limit}', False),
+    ('recipes favorited', '/api/recipes/?is_favorited=1&limit={limit}',
+     False),
+    ('recipes in cart', '/api/recipes/?is_in_shopping_cart=1&limit={limit}',
+     False),
+    ('recipes by tag', '/api/recipes/?tags=bench0&tags=bench1'
+                       '&limit={limit}', False),
+    ('recipes by all tags', '/api/recipes/?tags=bench0&tags=bench1'
+                            '&tags_mode=all&limit={limit}', False),
+    ('recipes search', '/api/recipes/?search=Рецепт&limit={limit}', False),
+    ('recipes match', '/api/recipes/match/?ingredients=1&ingredients=2'
+                      '&ingredients=3&limit={limit}', False),
+    ('recipes feed', '/api/recipes/feed/?limit={limit}', False),
+    ('subscriptions', '/api/users/subscriptions/?limit={limit}'
+                      '&recipes_limit=3', False),
+    ('subscriptions (cursor)', '/api/users/subscriptions/?pagination=cursor'
+                               '&limit={limit}&recipes_limit=3', False),
+    ('users list', '/api/users/?limit={limit}', False),
+)
+
+SINGLE = (
+    ('recipe detail', 'get', '/api/recipes/{recipe}/'),
+    ('ingredients search', 'get', '/api/ingredients/?name=мо'),
+    ('tags', 'get', '/api/tags/'),
+    ('user detail', 'get', '/api/users/{author}/'),
+    ('users me', 'get', '/api/users/me/'),
+    ('download shopping cart', 'get', '/api/recipes/download_shopping_cart/'),
+    ('download shopping cart (csv)', 'get',
+     '/api/recipes/download_shopping_cart/?file_format=csv'),
+    ('favorite add', 'post', '/api/recipes/{recipe}/favorite/'),
+    ('favorite remove', 'delete', '/api/recipes/{recipe}/favorite/'),
+    ('shopping cart add', 'post', '/api/recipes/{recipe}/shopping_cart/'),
+    ('shopping cart remove', 'delete',
+     '/api/recipes/{recipe}/shopping_cart/'),
+    ('subscribe', 'post', '/api/users/{author}/subscribe/'),
+    ('unsubscribe', 'delete', '/api/users/{author}/subscribe/'),
+)
+
+# Пакетные эндпоинты: число запросов не должно зависеть от числа id.
+BULK = (
+    ('favorites bulk add', 'post', '/api/recipes/favorite/'),
+    ('favorites bulk remove', 'delete', '/api/recipes/favorite/'),
+    ('shopping cart bulk add', 'post', '/api/recipes/shopping_cart/'),
+    ('shopping cart bulk remove', 'delete', '/api/recipes/shopping_cart/'),
+    ('subscribe bulk', 'post', '/api/users/subscribe/'),
+    ('unsubscribe bulk', 'delete', '/api/users/subscribe/'),
+)
+
+
+class Command(SeedCommand):
+    help = ('Заполняет временную БД синтетическими данными, обходит '
+            'эндпоинты API и падает, если число запросов растёт '
+            'вместе с размером страницы.')
+
+    failure_message = ('Число запросов зависит от размера страницы '
+                       'или числа id: ')
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--small-page', type=int, default=5)
+        parser.add_argument('--large-page', type=int, default=50)
+        # SQLite делит bulk_create на пачки по 249 строк, поэтому пакет
+        # побольше добавил бы в корзину лишний INSERT списка покупок.
+        parser.add_argument('--bulk-size', type=int, default=20)
+
+    def seed(self, options):
+        started = time.perf_counter()
+        user = super().seed(options)
+        self.stdout.write(
+            f'Данные созданы за {time.perf_counter() - started:.1f} с')
+        return user
+
+    def run(self, user, options):
+        client = APIClient()
+        client.force_authenticate(user)
+        anonymous = APIClient()
+        params = {
+            'recipe': Recipe.objects.exclude(author=user).exclude(
+                favorites__user=user).exclude(
+                shopping_cart__user=user).first().id,
+            'author': CustomUser.objects.exclude(
+                following__user=user).exclude(id=user.id).first().id,
+        }
+
+        self.stdout.write(f'{"endpoint":<40}{"queries":>10}'
+                          f'{"wall, ms":>10}{"p50, ms":>10}{"p95, ms":>10}')
+        failures = []
+        for name, path, is_anonymous in SCALED:
+            api = anonymous if is_anonymous else client
+            counts = []
+            for limit in (options['small_page'], options['large_page']):
+                counts.append(self.measure(
+                    api, f'{name} [{limit}]', 'get',
+                    path.format(limit=limit), options['repeat']))
+            if counts[0] != counts[1]:
+                failures.append(name)
+        for name, method, path in SINGLE:
+            # Добавление и удаление идут парами, поэтому повторять их можно
+            # только по одному разу за проход.
+            repeat = options['repeat'] if method == 'get' else 1
+            self.measure(client, name, method, path.format(**params), repeat)
+        # Пустая страница подписок с recipes_limit, как её запрашивает
+        # фронтенд у пользователя без подписок.
+        newcomer = APIClient()
+        newcomer.force_authenticate(CustomUser.objects.create(
+            username='bench_newcomer', email='bench_newcomer@example.com'))
+        self.measure(newcomer, 'subscriptions (none)', 'get',
+                     '/api/users/subscriptions/?recipes_limit=3',
+                     options['repeat'])
+        size = options['bulk_size']
+        ids = {
+            'recipes': list(Recipe.objects.exclude(
+                favorites__user=user).exclude(
+                shopping_cart__user=user).values_list('id', flat=True)[:size]),
+            'users': list(CustomUser.objects.exclude(
+                following__user=user).exclude(
+                id=user.id).values_list('id', flat=True)[:size]),
+        }
+        for name, method, path in BULK:
+            objects = ids[path.split('/')[2]]
+            counts = []
+            for limit in (options['small_page'], size):
+                counts.append(self.measure(
+                    client, f'{name} [{limit}]', method, path, 1,
+                    {'ids': objects[:limit]}))
+            if counts[0] != counts[1]:
+                failures.append(name)
+        return failures
+
+    def measure(self, client, name, method, path, repeat, data=None):
+        timings = []
+        query_counts = []
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = getattr(client, method)(path, data,
+                                                   format='json')
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                timings.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                raise CommandError(
+                    f'{name}: {method.upper()} {path} -> '
+                    f'{response.status_code}')
+            query_counts.append(len(queries))
+        p95 = (statistics.quantiles(timings, n=20)[-1]
+               if len(timings) > 1 else timings[0])
+        self.stdout.write(
+            f'{name:<40}{max(query_counts):>10}{sum(timings):>10.1f}'
+            f'{statistics.median(timings):>10.1f}{p95:>10.1f}')
+        return max(query_counts)
@@ -0,0 +1,118 @@
+import statistics
+import time
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.renderers import FastJSONRenderer, orjson
+from api.seed import SeedCommand
+from api.serializers import (FlatIngredientSerializer, FlatRecipeSerializer,
+                             FlatTagSerializer, IngredientSerializer,
+                             RecipeSerializer, TagSerializer)
+from recipes.models import Ingredient, Recipe, Tag
+
+CARD_FIELDS = {'id', 'name', 'image', 'cooking_time', 'author', 'tags',
+               'is_favorited', 'is_in_shopping_cart'}
+
+# Название, поля и вложенные объекты ответа со списком рецептов.
+RECIPE_CASES = (
+    ('recipes', None, ()),
+    ('recipes (card)', CARD_FIELDS, {'author', 'tags'}),
+    ('recipes (ids)', CARD_FIELDS, ()),
+)
+
+
+class Command(SeedCommand):
+    help = ('Сравнивает ModelSerializer и JSONRenderer с плоскими '
+            'сериализаторами и FastJSONRenderer на временной БД: ответы '
+            'должны совпадать побайтно, выводится время на элемент.')
+
+    users = 200
+    recipes = 1000
+    failure_message = 'Ответы не совпадают: '
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--limit', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def run(self, user, options):
+        factory = APIRequestFactory()
+
+        def context(fields=None, expand=()):
+            # Новый запрос на каждый проход: наборы избранного и корзины
+            # запоминаются в запросе.
+            request = Request(factory.get('/api/recipes/'))
+            request.user = user
+            return {'request': request, 'fields': fields, 'expand': expand}
+
+        limit = options['limit']
+        cases = [
+            (name,
+             lambda fields=fields, expand=expand: RecipeSerializer(
+                 Recipe.objects.with_related(fields, expand)[:limit],
+                 many=True, context=context(fields, expand)),
+             lambda fields=fields, expand=expand: FlatRecipeSerializer(
+                 Recipe.objects.values(
+                     *FlatRecipeSerializer.get_columns(fields))[:limit],
+                 many=True, context=context(fields, expand)))
+            for name, fields, expand in RECIPE_CASES]
+        cases += [
+            ('tags',
+             lambda: TagSerializer(Tag.objects.all(), many=True),
+             lambda: FlatTagSerializer(
+                 Tag.objects.values(*FlatTagSerializer.columns), many=True)),
+            ('ingredients',
+             lambda: IngredientSerializer(Ingredient.objects.all(),
+                                          many=True),
+             lambda: FlatIngredientSerializer(
+                 Ingredient.objects.values(*FlatIngredientSerializer.columns),
+                 many=True)),
+        ]
+
+        if orjson is None:
+            self.stdout.write('orjson не установлен, FastJSONRenderer '
+                              'работает на стандартном json')
+        self.stdout.write(
+            f'{"case":<20}{"items":>7}{"queries":>10}'
+            f'{"serialize, µs/item":>22}{"render, µs/item":>20}')
+        mismatches = []
+        for name, model_serializer, flat_serializer in cases:
+            model = self.measure(model_serializer, JSONRenderer(),
+                                 options['repeat'])
+            flat = self.measure(flat_serializer, FastJSONRenderer(),
+                                options['repeat'])
+            if model['body'] != flat['body']:
+                mismatches.append(name)
+            items = model['items']
+            self.stdout.write(
+                f'{name:<20}{items:>7}'
+                f'{model["queries"]:>5}/{flat["queries"]:<4}'
+                f'{model["serialize"] / items:>11.1f} ->'
+                f'{flat["serialize"] / items:>7.1f}'
+                f'{model["render"] / items:>10.2f} ->'
+                f'{flat["render"] / items:>6.2f}')
+        return mismatches
+
+    def measure(self, make_serializer, renderer, repeat):
+        """Медианы времени сериализации (вместе с чтением строк из БД)
+        и рендеринга в микросекундах."""
+        serialize = []
+        render = []
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                data = make_serializer().data
+                serialize.append((time.perf_counter() - started) * 10 ** 6)
+            started = time.perf_counter()
+            body = renderer.render(data)
+            render.append((time.perf_counter() - started) * 10 ** 6)
+        # FastJSONRenderer должен давать те же байты, что JSONRenderer.
+        if JSONRenderer().render(data) != body:
+            body = None
+        return {'items': len(data), 'queries': len(queries), 'body': body,
+                'serialize': statistics.median(serialize),
+                'render': statistics.median(render)}
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from api.cache import get_stats
+
+NAMESPACES = ('tags', 'ingredients', 'recipes')
+
+
+class Command(BaseCommand):
+    help = 'Показывает попадания и промахи кеша ответов API.'
+
+    def handle(self, *args, **options):
+        for namespace, stats in get_stats(NAMESPACES).items():
+            total = stats['hit'] + stats['miss']
+            ratio = stats['hit'] / total * 100 if total else 0
+            self.stdout.write(f'{namespace}: попаданий {stats["hit"]}, '
+                              f'промахов {stats["miss"]} ({ratio:.0f}%)')
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = ('Сверяет сохранённые списки покупок с корзинами '
+            'и при --fix пересобирает разошедшиеся.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true')
+
+    def handle(self, *args, **options):
+        user_ids = ShoppingListItem.objects.inconsistent_users()
+        if not user_ids:
+            self.stdout.write('Списки покупок согласованы')
+            return
+        if options['fix']:
+            ShoppingListItem.objects.rebuild(user_ids)
+            self.stdout.write(f'Пересобрано списков: {len(user_ids)}')
+            return
+        raise CommandError(
+            f'Расходятся списки пользователей: {user_ids}')
@@ -0,0 +1,74 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from api.seed import SeedCommand
+from recipes.models import Recipe
+from users.models import CustomUser
+from .benchmark_api import SCALED, SINGLE
+
+
+def sequential_scans(cursor, sql, tables):
+    """Таблицы, которые по плану запроса читаются целиком."""
+    if connection.vendor == 'postgresql':
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+        nodes = [cursor.fetchone()[0][0]['Plan']]
+        scans = []
+        while nodes:
+            node = nodes.pop()
+            if node['Node Type'] == 'Seq Scan':
+                scans.append(node['Relation Name'])
+            nodes.extend(node.get('Plans', ()))
+        return scans
+    cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+    scans = []
+    for *_, detail in cursor.fetchall():
+        words = detail.split()
+        if (words[0] == 'SCAN' and words[1] in tables
+                and 'USING' not in words):
+            scans.append(words[1])
+    return scans
+
+
+class Command(SeedCommand):
+    help = ('Заполняет временную БД, выполняет основные запросы API '
+            'и выводит те, чей план читает таблицу целиком.')
+
+    def run(self, user, options):
+        client = APIClient()
+        client.force_authenticate(user)
+        anonymous = APIClient()
+        params = {
+            'recipe': Recipe.objects.exclude(author=user).first().id,
+            'author': CustomUser.objects.exclude(id=user.id).first().id,
+        }
+        endpoints = [(name, path.format(limit=10), is_anonymous)
+                     for name, path, is_anonymous in SCALED]
+        endpoints += [(name, path.format(**params), False)
+                      for name, method, path in SINGLE if method == 'get']
+        tables = set(connection.introspection.table_names())
+        found = 0
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # Без seq scan планировщик берёт любой подходящий индекс,
+                # и в отчёт попадают только запросы, которым индекса нет:
+                # на маленькой БД он выбрал бы seq scan и при наличии индекса.
+                cursor.execute('SET enable_seqscan = off')
+            for name, path, is_anonymous in endpoints:
+                with CaptureQueriesContext(connection) as queries:
+                    response = (anonymous if is_anonymous else client).get(
+                        path)
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                reported = set()
+                for query in queries:
+                    sql = query['sql']
+                    if not sql.startswith('SELECT') or sql in reported:
+                        continue
+                    reported.add(sql)
+                    for table in sequential_scans(cursor, sql, tables):
+                        found += 1
+                        self.stdout.write(f'{name}: {table}\n    {sql}')
+            if connection.vendor == 'postgresql':
+                cursor.execute('RESET enable_seqscan')
+        self.stdout.write(f'Полных чтений таблиц: {found}')
@@ -1,16 +1,101 @@
+import csv
 import json
+import time
+from itertools import islice
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from recipes.models import Ingredient
 
+CHUNK_SIZE = 64 * 1024
+
+
+def read_json(f):
+    """Построчно разбирает JSON-массив объектов, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    for chunk in iter(lambda: f.read(CHUNK_SIZE), ''):
+        buffer += chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if not started and position < len(buffer):
+                if buffer[position] != '[':
+                    raise CommandError('Ожидается JSON-массив')
+                started = True
+                position += 1
+                continue
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                break
+            yield item
+        buffer = buffer[position:]
+    if buffer.strip():
+        raise CommandError('Файл JSON обрывается на середине')
+
+
+def read_csv(f):
+    for row in csv.DictReader(f, fieldnames=('name', 'measurement_unit')):
+        if row == {'name': 'name', 'measurement_unit': 'measurement_unit'}:
+            continue
+        yield row
+
+
+READERS = {
+    'json': read_json,
+    'csv': read_csv,
+}
+
 
 class Command(BaseCommand):
+    help = ('Загружает ингредиенты из JSON или CSV пачками. '
+            'Повторный запуск не создаёт дубликатов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='ingredients.json')
+        parser.add_argument('--format', choices=READERS,
+                            help='По умолчанию определяется по расширению')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true')
+
     def handle(self, *args, **options):
-        with open('ingredients.json', 'rb') as f:
-            data = json.load(f)
-            for i in data:
-                ingredient = Ingredient()
-                ingredient.name = i['name']
-                ingredient.measurement_unit = i['measurement_unit']
-                ingredient.save()
-                print(i['name'], i['measurement_unit'])
+        file_format = options['format'] or options['path'].rsplit('.', 1)[-1]
+        if file_format not in READERS:
+            raise CommandError(f'Неизвестный формат файла: {file_format}')
+        started = time.perf_counter()
+        count_before = Ingredient.objects.count()
+        total = new = 0
+        with open(options['path'], encoding='utf-8', newline='') as f:
+            rows = READERS[file_format](f)
+            while True:
+                batch = [
+                    (row['name'].strip(), row['measurement_unit'].strip())
+                    for row in islice(rows, options['batch_size'])
+                ]
+                if not batch:
+                    break
+                total += len(batch)
+                batch = set(batch)
+                if options['dry_run']:
+                    new += len(batch - set(Ingredient.objects.filter(
+                        name__in={name for name, _ in batch}
+                    ).values_list('name', 'measurement_unit')))
+                else:
+                    Ingredient.objects.bulk_create(
+                        (Ingredient(name=name, measurement_unit=unit)
+                         for name, unit in batch),
+                        ignore_conflicts=True)
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f'Обработано {total} строк, {total / elapsed:.0f} '
+                    f'строк/с')
+        if not options['dry_run']:
+            new = Ingredient.objects.count() - count_before
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Будет добавлено" if options["dry_run"] else "Добавлено"} '
+            f'{new} из {total} за {elapsed:.2f} с'))
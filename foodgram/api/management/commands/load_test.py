@@ -0,0 +1,70 @@
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand
+
+# Горячие пути чтения; скачивание списка покупок добавляется с --token.
+PATHS = (
+    '/api/recipes/',
+    '/api/recipes/?page=2&limit=20',
+    '/api/tags/',
+    '/api/ingredients/?name=мо',
+)
+AUTHENTICATED_PATHS = (
+    '/api/recipes/download_shopping_cart/',
+)
+
+
+class Command(BaseCommand):
+    help = ('Нагружает запущенный сервер параллельными запросами и выводит '
+            'число запросов в секунду и задержки. Запускается против '
+            'SERVER_MODE=wsgi и asgi, чтобы сравнить режимы.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Путь для нагрузки, можно несколько раз.')
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--token', help='Токен пользователя: запросы '
+                                            'идут от его имени.')
+
+    def handle(self, *args, **options):
+        headers = {}
+        paths = options['paths'] or PATHS
+        if options['token']:
+            headers['Authorization'] = f'Token {options["token"]}'
+            if not options['paths']:
+                paths = PATHS + AUTHENTICATED_PATHS
+        local = threading.local()
+
+        def fetch(url):
+            if not hasattr(local, 'session'):
+                local.session = requests.Session()
+                local.session.headers.update(headers)
+            started = time.perf_counter()
+            try:
+                response = local.session.get(url)
+                ok = response.status_code == 200
+            except requests.RequestException:
+                ok = False
+            return time.perf_counter() - started, ok
+
+        self.stdout.write(f'{"path":<45} {"rps":>8} {"p50 ms":>8} '
+                          f'{"p95 ms":>8} {"errors":>7}')
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            for path in paths:
+                url = options['url'].rstrip('/') + path
+                started = time.perf_counter()
+                results = list(pool.map(fetch, [url] * options['requests']))
+                elapsed = time.perf_counter() - started
+                timings = sorted(duration * 1000 for duration, _ in results)
+                errors = sum(not ok for _, ok in results)
+                p95 = statistics.quantiles(timings, n=20)[-1]
+                self.stdout.write(
+                    f'{path:<45} {len(results) / elapsed:>8.1f} '
+                    f'{statistics.median(timings):>8.1f} {p95:>8.1f} '
+                    f'{errors:>7}')
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from api.images import process_recipe_image
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Строит уменьшенные копии картинок рецептов, у которых их '
+            'ещё нет (например, если процесс упал до конца обработки).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Пересобрать копии всех рецептов.')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(image_variants={})
+        processed = failed = 0
+        for recipe_id, name in recipes.values_list('id', 'image').iterator():
+            if process_recipe_image(recipe_id, name):
+                processed += 1
+            else:
+                failed += 1
+        self.stdout.write(f'Обработано: {processed}, с ошибкой: {failed}')
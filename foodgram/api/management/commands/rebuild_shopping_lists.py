@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает сохранённые списки покупок по корзинам.'
+
+    def handle(self, *args, **options):
+        ShoppingListItem.objects.rebuild()
+        self.stdout.write(
+            f'Готово, позиций: {ShoppingListItem.objects.count()}')
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from recipes.counters import reconcile
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает счётчики избранного, корзин и рецептов '
+            'автора по реальным данным.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        for counter, drifted in reconcile(options['dry_run']).items():
+            self.stdout.write(f'{counter}: расхождений {drifted}')
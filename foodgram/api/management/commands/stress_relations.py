@@ -0,0 +1,122 @@
+import logging
+import os
+import statistics
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from api.seed import SeedCommand
+from recipes.counters import reconcile
+from recipes.models import Favorites, Recipe, ShoppingCart, ShoppingListItem
+from users.models import CustomUser, Follow
+
+# Название, модель связи и путь.
+SCENARIOS = (
+    ('favorite', Favorites, '/api/recipes/{recipe}/favorite/'),
+    ('shopping cart', ShoppingCart, '/api/recipes/{recipe}/shopping_cart/'),
+    ('subscribe', Follow, '/api/users/{author}/subscribe/'),
+)
+# Коды ответов: ровно один из одновременных запросов получает первый,
+# остальные — второй.
+EXPECTED = {
+    'post': (201, 400),
+    'delete': (204, 404),
+}
+
+
+class Command(SeedCommand):
+    help = ('Заполняет временную БД и из многих потоков одновременно '
+            'добавляет и удаляет одну и ту же пару в избранном, корзине '
+            'и подписках. Падает, если пара добавилась или удалилась '
+            'не ровно один раз, ответ был 5xx или разошлись счётчики.')
+
+    users = 50
+    recipes = 200
+    seed_options = {'follows': 5, 'favorites': 10, 'cart': 5}
+    failure_separator = '\n'
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--rounds', type=int, default=5)
+
+    def handle(self, *args, **options):
+        # Ответы 400 и 404 здесь ожидаемы, в лог пишутся только 5xx.
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+        if connection.vendor == 'sqlite':
+            # Потоки открывают свои соединения, а общая БД в памяти
+            # блокирует таблицы целиком, поэтому тестовая БД — файл.
+            connection.settings_dict['TEST']['NAME'] = os.path.join(
+                tempfile.mkdtemp(), 'stress.sqlite3')
+        super().handle(*args, **options)
+
+    def run(self, user, options):
+        recipes = Recipe.objects.exclude(author=user).exclude(
+            favorites__user=user).exclude(shopping_cart__user=user)
+        authors = CustomUser.objects.exclude(following__user=user).exclude(
+            id=user.id)
+        failures = []
+        self.stdout.write(f'{"scenario":<26}{"statuses":<24}{"queries":>8}'
+                          f'{"p50, ms":>10}{"p95, ms":>10}')
+        with ThreadPoolExecutor(options['threads']) as pool:
+            for round_number in range(options['rounds']):
+                params = {'recipe': recipes[round_number].id,
+                          'author': authors[round_number].id}
+                for name, model, path in SCENARIOS:
+                    path = path.format(**params)
+                    for method in ('post', 'delete'):
+                        failures += self.hit(
+                            pool, options['threads'], user, method, path,
+                            f'{name} {method} #{round_number + 1}')
+                    field = 'author' if model is Follow else 'recipe'
+                    if model.objects.filter(
+                            user=user, **{field: params[field]}).exists():
+                        failures.append(f'{name}: связь осталась после '
+                                        f'удаления')
+        drift = {counter: count for counter, count in
+                 reconcile(dry_run=True).items() if count}
+        if drift:
+            failures.append(f'Разошлись счётчики: {drift}')
+        if ShoppingListItem.objects.inconsistent_users():
+            failures.append('Разошёлся список покупок')
+        return failures
+
+    def hit(self, pool, threads, user, method, path, name):
+        barrier = threading.Barrier(threads)
+
+        def request(_):
+            client = APIClient()
+            client.force_authenticate(user)
+            barrier.wait()
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = getattr(client, method)(path)
+                elapsed = (time.perf_counter() - started) * 1000
+            connection.close()
+            return response.status_code, len(queries), elapsed
+
+        results = list(pool.map(request, range(threads)))
+        statuses = Counter(code for code, _, _ in results)
+        timings = sorted(elapsed for _, _, elapsed in results)
+        summary = ' '.join(f'{code}×{count}'
+                           for code, count in sorted(statuses.items()))
+        self.stdout.write(
+            f'{name:<26}{summary:<24}'
+            f'{max(count for _, count, _ in results):>8}'
+            f'{statistics.median(timings):>10.1f}'
+            f'{statistics.quantiles(timings, n=20)[-1]:>10.1f}')
+        success, repeated = EXPECTED[method]
+        if path.endswith('/subscribe/') and method == 'delete':
+            # Отписка отвечает 204 и тогда, когда подписки уже нет.
+            expected = {success: threads}
+        else:
+            expected = {success: 1, repeated: threads - 1}
+        if statuses != expected:
+            return [f'{name}: {dict(statuses)}']
+        return []
@@ -0,0 +1,89 @@
+import json
+import logging
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger('foodgram.performance')
+
+
+class QueryProfile:
+    """Обёртка для connection.execute_wrapper: считает запросы и их время.
+
+    Отпечатком запроса служит его SQL без параметров, поэтому
+    одинаковые запросы с разными id (типичный N+1) совпадают.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.fingerprints[sql] += 1
+
+    def duplicates(self):
+        return {sql: count for sql, count in self.fingerprints.items()
+                if count > 1}
+
+
+class SQLProfilingMiddleware:
+    """Замеряет SQL, время view и рендеринга каждого запроса.
+
+    С SQL_PROFILING_HEADERS отдаёт замеры в заголовках Server-Timing
+    и X-Query-Count, а запросы дольше SLOW_REQUEST_MS пишет в лог
+    foodgram.performance вместе с повторяющимися SQL.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profile = QueryProfile()
+        request.view_finished = None
+        started = time.perf_counter()
+        with connection.execute_wrapper(profile):
+            response = self.get_response(request)
+        finished = time.perf_counter()
+        view_finished = request.view_finished or finished
+        timings = {
+            'total': (finished - started) * 1000,
+            'db': profile.duration * 1000,
+            # Время view без SQL: в основном работа сериализаторов.
+            'app': (view_finished - started - profile.duration) * 1000,
+            'render': (finished - view_finished) * 1000,
+        }
+        duplicates = profile.duplicates()
+        if settings.SQL_PROFILING_HEADERS:
+            response['Server-Timing'] = ', '.join(
+                f'{name};dur={value:.1f}' for name, value in timings.items())
+            response['X-Query-Count'] = profile.count
+            response['X-Duplicate-Query-Count'] = sum(duplicates.values())
+        if timings['total'] >= settings.SLOW_REQUEST_MS:
+            logger.warning(json.dumps({
+                'method': request.method,
+                'path': request.get_full_path(),
+                'status': response.status_code,
+                'queries': profile.count,
+                'timings_ms': {name: round(value, 1)
+                               for name, value in timings.items()},
+                'duplicates': [
+                    {'sql': sql, 'count': count}
+                    for sql, count in sorted(duplicates.items(),
+                                             key=lambda item: -item[1])
+                ],
+            }, ensure_ascii=False))
+        return response
+
+    def process_template_response(self, request, response):
+        # Вызывается перед рендерингом ответа DRF: здесь заканчивается view.
+        request.view_finished = time.perf_counter()
+        return response
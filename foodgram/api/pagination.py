@@ -1,4 +1,5 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import (BasePagination, CursorPagination,
+                                       PageNumberPagination)
 
 from foodgram.settings import PAGE_SIZE
 
@@ -6,3 +7,38 @@ from foodgram.settings import PAGE_SIZE
 class LimitPageNumberPagination(PageNumberPagination):
     page_size = PAGE_SIZE
     page_size_query_param = 'limit'
+
+
+class LimitCursorPagination(CursorPagination):
+    page_size = PAGE_SIZE
+    page_size_query_param = 'limit'
+    ordering = '-id'
+
+
+class CursorOrPageNumberPagination(BasePagination):
+    """Постраничная пагинация по умолчанию и курсорная по запросу.
+
+    Курсорная включается параметром ?pagination=cursor, а дальше ссылками
+    next/previous с параметром cursor. Она не делает COUNT(*) и OFFSET,
+    поэтому глубокая прокрутка ленты стоит столько же, сколько первая
+    страница. Порядок курсора берётся из cursor_ordering у view.
+    С параметрами из page_number_params у view, которые задают свой
+    порядок, пагинация остаётся постраничной.
+    """
+    cursor_query_param = 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if ((params.get('pagination') == 'cursor'
+                or self.cursor_query_param in params)
+                and not any(param in params for param in
+                            getattr(view, 'page_number_params', ()))):
+            self.paginator = LimitCursorPagination()
+            self.paginator.ordering = getattr(
+                view, 'cursor_ordering', self.paginator.ordering)
+        else:
+            self.paginator = LimitPageNumberPagination()
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
@@ -0,0 +1,154 @@
+import json
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (override_settings, setup_test_environment,
+                               teardown_test_environment)
+
+from recipes.counters import reconcile
+from recipes.models import (Favorites, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingCart, ShoppingListItem, Tag, TagRecipe)
+from users.models import CustomUser, Follow
+
+BATCH_SIZE = 1000
+
+
+@contextmanager
+def temporary_database():
+    """Переключает соединение на пустую тестовую БД на время блока,
+    чтобы команды-бенчмарки не трогали рабочие данные."""
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def seed_dataset(ingredients_path, users=1000, recipes=3000,
+                 ingredients_per_recipe=8, follows=50, favorites=100,
+                 cart=20, seed=0):
+    """Наполняет БД синтетическими данными для бенчмарков.
+
+    Возвращает пользователя, у которого есть подписки, избранное
+    и корзина: от его имени удобно дёргать эндпоинты.
+    """
+    rnd = random.Random(seed)
+    if not Ingredient.objects.exists():
+        with open(ingredients_path, 'rb') as f:
+            Ingredient.objects.bulk_create(
+                (Ingredient(name=item['name'],
+                            measurement_unit=item['measurement_unit'])
+                 for item in json.load(f)),
+                batch_size=BATCH_SIZE)
+    ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+    for index, (color, _) in enumerate(Tag.COLORS):
+        Tag.objects.get_or_create(color=color, defaults={
+            'name': f'bench{index}', 'slug': f'bench{index}'})
+    tag_ids = list(Tag.objects.values_list('id', flat=True))
+
+    password = make_password('benchmark')
+    CustomUser.objects.bulk_create(
+        (CustomUser(username=f'bench_user_{index}',
+                    email=f'bench_user_{index}@example.com',
+                    first_name='Bench', last_name=str(index),
+                    password=password)
+         for index in range(users)),
+        batch_size=BATCH_SIZE)
+    user_ids = list(CustomUser.objects.filter(
+        username__startswith='bench_user_').values_list('id', flat=True))
+
+    Recipe.objects.bulk_create(
+        (Recipe(author_id=rnd.choice(user_ids), name=f'Рецепт {index}',
+                image='foodgram/benchmark.png',
+                text=f'Описание рецепта {index}',
+                cooking_time=rnd.randint(1, 180))
+         for index in range(recipes)),
+        batch_size=BATCH_SIZE)
+    recipe_ids = list(Recipe.objects.filter(
+        author_id__in=user_ids).values_list('id', flat=True))
+
+    IngredientRecipe.objects.bulk_create(
+        (IngredientRecipe(recipe_id=recipe_id, ingredient_id=ingredient_id,
+                          amount=rnd.randint(1, 500))
+         for recipe_id in recipe_ids
+         for ingredient_id in rnd.sample(ingredient_ids,
+                                         ingredients_per_recipe)),
+        batch_size=BATCH_SIZE)
+    TagRecipe.objects.bulk_create(
+        (TagRecipe(recipe_id=recipe_id, tag_id=tag_id)
+         for recipe_id in recipe_ids
+         for tag_id in rnd.sample(tag_ids, rnd.randint(1, len(tag_ids)))),
+        batch_size=BATCH_SIZE)
+
+    main_user_id = user_ids[0]
+    Follow.objects.bulk_create(
+        (Follow(user_id=user_id, author_id=author_id)
+         for user_id in user_ids
+         for author_id in rnd.sample(user_ids, min(5, len(user_ids)))
+         if author_id != user_id),
+        batch_size=BATCH_SIZE, ignore_conflicts=True)
+    Follow.objects.bulk_create(
+        (Follow(user_id=main_user_id, author_id=author_id)
+         for author_id in rnd.sample(
+             user_ids[1:], min(follows, len(user_ids) - 1))),
+        ignore_conflicts=True)
+    for model, count in ((Favorites, favorites), (ShoppingCart, cart)):
+        model.objects.bulk_create(
+            (model(user_id=main_user_id, recipe_id=recipe_id)
+             for recipe_id in rnd.sample(
+                 recipe_ids, min(count, len(recipe_ids)))),
+            ignore_conflicts=True)
+        model.objects.bulk_create(
+            (model(user_id=rnd.choice(user_ids), recipe_id=recipe_id)
+             for recipe_id in rnd.sample(recipe_ids, len(recipe_ids) // 2)),
+            batch_size=BATCH_SIZE, ignore_conflicts=True)
+    ShoppingListItem.objects.rebuild()
+    reconcile()
+    return CustomUser.objects.get(id=main_user_id)
+
+
+class SeedCommand(BaseCommand):
+    """Основа команд-бенчмарков: временная БД с синтетическими данными
+    и пустой кеш.
+
+    Наследник реализует run(user, options) и возвращает список проблем:
+    если он не пуст, команда падает с CommandError.
+    """
+
+    users = 1000
+    recipes = 3000
+    # Прочие аргументы seed_dataset.
+    seed_options = {}
+    failure_message = ''
+    failure_separator = ', '
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=self.users)
+        parser.add_argument('--recipes', type=int, default=self.recipes)
+        parser.add_argument(
+            '--ingredients', default=settings.BASE_DIR / 'ingredients.json')
+
+    # Пустой кеш: команды не трогают боевой кеш и меряют эндпоинты
+    # без кеша ответов.
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+    def handle(self, *args, **options):
+        with temporary_database():
+            failures = self.run(self.seed(options), options)
+        if failures:
+            raise CommandError(self.failure_message
+                               + self.failure_separator.join(failures))
+
+    def seed(self, options):
+        return seed_dataset(options['ingredients'], users=options['users'],
+                            recipes=options['recipes'], **self.seed_options)
+
+    def run(self, user, options):
+        raise NotImplementedError
@@ -1,20 +1,31 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from djoser.serializers import UserSerializer
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 
-from recipes.models import (Favorites, Ingredient, IngredientRecipe, Recipe,
-                            ShoppingCart, Tag, TagRecipe)
+from recipes.models import (Ingredient, IngredientRecipe, Recipe,
+                            ShoppingListItem, Tag, TagRecipe)
+from recipes.search import highlight
 from users.models import CustomUser, Follow
+from .images import (delete_variants, schedule_image_processing,
+                     variant_urls)
+from .interactions import get_interactions
+from .utils import MAX_ID, get_recipes_limit
 
 
 class CommonSubscribed(metaclass=serializers.SerializerMetaclass):
     is_subscribed = serializers.SerializerMethodField()
 
     def get_is_subscribed(self, obj):
-        request = self.context.get('request')
-        if request is None or request.user.is_anonymous:
-            return False
-        return Follow.objects.filter(user=request.user, author=obj).exists()
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        return obj.id in get_interactions(
+            self.context.get('request')).following
 
 
 class CustomUserSerializer(UserSerializer, CommonSubscribed):
@@ -56,17 +67,44 @@ class CommonRecipe(metaclass=serializers.SerializerMetaclass):
     is_in_shopping_cart = serializers.SerializerMethodField()
 
     def get_is_favorited(self, obj):
-        request = self.context.get('request')
-        if request is None or not request.user.is_authenticated:
-            return False
-        return Favorites.objects.filter(user=request.user, recipe=obj).exists()
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
+        return obj.id in get_interactions(
+            self.context.get('request')).favorites
 
     def get_is_in_shopping_cart(self, obj):
-        request = self.context.get('request')
-        if request is None or not request.user.is_authenticated:
-            return False
-        return ShoppingCart.objects.filter(
-            user=request.user, recipe=obj).exists()
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
+        return obj.id in get_interactions(self.context.get('request')).cart
+
+
+class RecipeImageField(Base64ImageField):
+    """Base64ImageField с ограничением размера файла и числа пикселей.
+
+    Длина строки проверяется до декодирования base64, а размеры
+    картинки — по заголовку, без распаковки.
+    """
+
+    def to_internal_value(self, data):
+        max_bytes = settings.IMAGE_UPLOAD_MAX_BYTES
+        if isinstance(data, str) and len(data) > max_bytes * 4 // 3 + 100:
+            raise serializers.ValidationError(
+                f'Размер картинки не должен превышать '
+                f'{max_bytes // 1024 // 1024} МБ.')
+        file = super().to_internal_value(data)
+        if file is not None:
+            width, height = file.image.size
+            if width * height > settings.IMAGE_MAX_PIXELS:
+                raise serializers.ValidationError(
+                    'Слишком большое разрешение картинки.')
+        return file
+
+
+class ImageVariants(metaclass=serializers.SerializerMetaclass):
+    images = serializers.SerializerMethodField()
+
+    def get_images(self, obj):
+        return variant_urls(obj.image_variants, self.context.get('request'))
 
 
 class IngredientAmountSerializer(serializers.ModelSerializer):
@@ -88,18 +126,249 @@ class IngredientAmountRecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'amount')
 
 
-class RecipeSerializer(serializers.ModelSerializer, CommonRecipe):
+class SparseFields:
+    """Выводит только поля из context['fields'], а вложенные объекты,
+    которых нет в context['expand'], заменяет их id.
+
+    Без context['fields'] выводятся все поля целиком.
+    """
+    # Поле с вложенным объектом и поле, которое выводит вместо него id.
+    collapsed_fields = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = self.context.get('fields')
+        if fields is None:
+            return
+        expand = self.context.get('expand', ())
+        for name in list(self.fields):
+            if name not in fields:
+                self.fields.pop(name)
+            elif name in self.collapsed_fields and name not in expand:
+                self.fields[name] = self.collapsed_fields[name]()
+
+
+class RecipeSerializer(SparseFields, serializers.ModelSerializer,
+                       CommonRecipe, ImageVariants):
     tags = TagSerializer(many=True, read_only=True)
     ingredients = IngredientAmountSerializer(source='ingredient_recipes',
                                              many=True)
     author = CustomUserSerializer(read_only=True)
 
+    collapsed_fields = {
+        'tags': lambda: serializers.PrimaryKeyRelatedField(
+            many=True, read_only=True),
+        'ingredients': lambda: serializers.SlugRelatedField(
+            source='ingredient_recipes', slug_field='ingredient_id',
+            many=True, read_only=True),
+        'author': lambda: serializers.PrimaryKeyRelatedField(read_only=True),
+    }
+
     class Meta:
         model = Recipe
         fields = (
             'id', 'tags', 'author', 'ingredients',
             'is_favorited', 'is_in_shopping_cart',
-            'name', 'image', 'text', 'cooking_time')
+            'name', 'image', 'images', 'text', 'cooking_time')
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if hasattr(instance, 'search_headline'):
+            data['search_headline'] = highlight(instance.search_headline)
+        return data
+
+
+class RecipeMatchSerializer(RecipeSerializer):
+    """Рецепт с долей ингредиентов, которые есть у пользователя
+    (context['ingredients']), и списком недостающих."""
+    coverage = serializers.SerializerMethodField()
+    matched_count = serializers.SerializerMethodField()
+    missing_ingredients = serializers.SerializerMethodField()
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + (
+            'coverage', 'matched_count', 'missing_ingredients')
+
+    def get_matched_count(self, obj):
+        owned = self.context['ingredients']
+        return sum(row.ingredient_id in owned
+                   for row in obj.ingredient_recipes.all())
+
+    def get_coverage(self, obj):
+        total = len(obj.ingredient_recipes.all())
+        return round(self.get_matched_count(obj) / total, 3) if total else 0
+
+    def get_missing_ingredients(self, obj):
+        owned = self.context['ingredients']
+        return IngredientAmountSerializer(
+            [row for row in obj.ingredient_recipes.all()
+             if row.ingredient_id not in owned], many=True).data
+
+
+class FlatListSerializer(serializers.ListSerializer):
+    """Список для FlatSerializer: перед выводом дочерний сериализатор
+    получает всю страницу строк, чтобы прочитать связи разом."""
+
+    def to_representation(self, data):
+        rows = list(data)
+        self.child.prepare(rows)
+        return [self.child.to_representation(row) for row in rows]
+
+
+class FlatSerializer(serializers.BaseSerializer):
+    """Сериализатор для чтения строк .values(*columns) без полей DRF.
+
+    Строка из columns уже совпадает с ответом ModelSerializer и
+    отдаётся как есть.
+    """
+    columns = ()
+
+    class Meta:
+        list_serializer_class = FlatListSerializer
+
+    def prepare(self, rows):
+        pass
+
+    def to_representation(self, row):
+        return row
+
+
+class FlatTagSerializer(FlatSerializer):
+    columns = TagSerializer.Meta.fields
+
+
+class FlatIngredientSerializer(FlatSerializer):
+    columns = IngredientSerializer.Meta.fields
+
+
+class FlatRecipeSerializer(FlatSerializer):
+    """RecipeSerializer для строк Recipe.objects.values(*get_columns()).
+
+    Теги, ингредиенты и авторы страницы читаются в prepare одним
+    запросом на связь, а для каждой строки остаётся только собрать
+    словарь заранее выбранными функциями. Учитывает context['fields']
+    и context['expand'] так же, как SparseFields.
+    """
+    # Столбцы Recipe, из которых выводится поле.
+    field_columns = {
+        'author': 'author_id',
+        'name': 'name',
+        'image': 'image',
+        'images': 'image_variants',
+        'text': 'text',
+        'cooking_time': 'cooking_time',
+    }
+    # Поля автора, которые читаются из БД: is_subscribed берётся из
+    # подписок, а password только для записи.
+    author_columns = tuple(name for name in CustomUserSerializer.Meta.fields
+                           if name not in ('is_subscribed', 'password'))
+    amount_exponent = Decimal(1).scaleb(
+        -IngredientRecipe._meta.get_field('amount').decimal_places)
+
+    @classmethod
+    def get_columns(cls, fields=None):
+        return ['id'] + [column for name, column in cls.field_columns.items()
+                         if fields is None or name in fields]
+
+    def prepare(self, rows):
+        fields = self.context.get('fields')
+        expand = self.context.get('expand', ())
+        request = self.context.get('request')
+        names = [name for name in RecipeSerializer.Meta.fields
+                 if fields is None or name in fields]
+        ids = [row['id'] for row in rows]
+        getters = {
+            'id': lambda row: row['id'],
+            'name': lambda row: row['name'],
+            'image': lambda row: self.get_image(row['image'], request),
+            'images': lambda row: variant_urls(row['image_variants'],
+                                               request),
+            'text': lambda row: row['text'],
+            'cooking_time': lambda row: row['cooking_time'],
+        }
+        nested_author = 'author' in names and (
+            fields is None or 'author' in expand)
+        if nested_author or {'is_favorited',
+                             'is_in_shopping_cart'} & set(names):
+            interactions = get_interactions(request)
+            getters['is_favorited'] = (
+                lambda row: row['id'] in interactions.favorites)
+            getters['is_in_shopping_cart'] = (
+                lambda row: row['id'] in interactions.cart)
+        if 'tags' in names:
+            tags = self.load_tags(ids, fields is None or 'tags' in expand)
+            getters['tags'] = lambda row: tags.get(row['id'], [])
+        if 'ingredients' in names:
+            ingredients = self.load_ingredients(
+                ids, fields is None or 'ingredients' in expand)
+            getters['ingredients'] = (
+                lambda row: ingredients.get(row['id'], []))
+        if nested_author:
+            authors = self.load_authors({row['author_id'] for row in rows},
+                                        interactions.following)
+            getters['author'] = lambda row: authors[row['author_id']]
+        elif 'author' in names:
+            getters['author'] = lambda row: row['author_id']
+        self.getters = [(name, getters[name]) for name in names]
+
+    def load_tags(self, ids, nested):
+        rows = TagRecipe.objects.filter(recipe_id__in=ids).order_by('tag_id')
+        tags = defaultdict(list)
+        if not nested:
+            for recipe_id, tag_id in rows.values_list('recipe_id', 'tag_id'):
+                tags[recipe_id].append(tag_id)
+            return tags
+        # Одинаковые теги разных рецептов — один и тот же словарь.
+        shared = {}
+        for recipe_id, *tag in rows.values_list(
+                'recipe_id', 'tag_id', 'tag__name', 'tag__color',
+                'tag__slug'):
+            if tag[0] not in shared:
+                shared[tag[0]] = dict(zip(TagSerializer.Meta.fields, tag))
+            tags[recipe_id].append(shared[tag[0]])
+        return tags
+
+    def load_ingredients(self, ids, nested):
+        rows = IngredientRecipe.objects.filter(
+            recipe_id__in=ids).order_by('id')
+        ingredients = defaultdict(list)
+        if not nested:
+            for recipe_id, ingredient_id in rows.values_list(
+                    'recipe_id', 'ingredient_id'):
+                ingredients[recipe_id].append(ingredient_id)
+            return ingredients
+        for recipe_id, ingredient_id, name, unit, amount in rows.values_list(
+                'recipe_id', 'ingredient_id', 'ingredient__name',
+                'ingredient__measurement_unit', 'amount'):
+            ingredients[recipe_id].append({
+                'id': ingredient_id,
+                'name': name,
+                'measurement_unit': unit,
+                'amount': f'{amount.quantize(self.amount_exponent):f}',
+            })
+        return ingredients
+
+    def load_authors(self, ids, following):
+        authors = {}
+        for author in CustomUser.objects.filter(id__in=ids).values(
+                *self.author_columns):
+            author['is_subscribed'] = author['id'] in following
+            authors[author['id']] = author
+        return authors
+
+    def get_image(self, name, request):
+        if not name:
+            return None
+        url = Recipe._meta.get_field('image').storage.url(name)
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+    def to_representation(self, row):
+        data = {name: get(row) for name, get in self.getters}
+        if 'search_headline' in row:
+            data['search_headline'] = highlight(row['search_headline'])
+        return data
 
 
 class RecipeSerializerPost(serializers.ModelSerializer, CommonRecipe):
@@ -109,7 +378,7 @@ class RecipeSerializerPost(serializers.ModelSerializer, CommonRecipe):
         many=True)
     ingredients = IngredientAmountRecipeSerializer(source='ingredient_recipes',
                                                    many=True)
-    image = Base64ImageField(max_length=None, use_url=False,)
+    image = RecipeImageField(max_length=None, use_url=False,)
 
     class Meta:
         model = Recipe
@@ -119,21 +388,27 @@ class RecipeSerializerPost(serializers.ModelSerializer, CommonRecipe):
             'name', 'image', 'text', 'cooking_time')
 
     def validate(self, data):
-        ingredients_list = []
-        ingredients = data['ingredient_recipes']
-        for ingredient in ingredients:
+        ingredients = data.get('ingredient_recipes')
+        if ingredients is None:
+            return data
+        ids = [ingredient['ingredient']['id'] for ingredient in ingredients]
+        existing = set(Ingredient.objects.filter(
+            id__in=ids).values_list('id', flat=True))
+        seen = set()
+        errors = []
+        for ingredient, id_to_check in zip(ingredients, ids):
+            item_errors = {}
             if ingredient['amount'] < 1:
-                raise serializers.ValidationError('Количество должно быть'
-                                                  'равным или больше 1!')
-            id_to_check = ingredient['ingredient']['id']
-            ingredient_to_check = Ingredient.objects.filter(id=id_to_check)
-            if not ingredient_to_check.exists():
-                raise serializers.ValidationError('Данного продукта'
-                                                  'нет в базе!')
-            if id_to_check in ingredients_list:
-                raise serializers.ValidationError('Ингредиенты должны '
-                                                  'быть уникальными!')
-            ingredients_list.append(id_to_check)
+                item_errors['amount'] = ['Количество должно быть '
+                                         'равным или больше 1!']
+            if id_to_check not in existing:
+                item_errors['id'] = ['Данного продукта нет в базе!']
+            elif id_to_check in seen:
+                item_errors['id'] = ['Ингредиенты должны быть уникальными!']
+            seen.add(id_to_check)
+            errors.append(item_errors)
+        if any(errors):
+            raise serializers.ValidationError({'ingredients': errors})
         return data
 
     def add_tags_ingredients(self, tags, ingredients, recipe):
@@ -152,27 +427,75 @@ class RecipeSerializerPost(serializers.ModelSerializer, CommonRecipe):
         image = validated_data.get('image')
         text = validated_data.get('text')
         cooking_time = validated_data.get('cooking_time')
-        recipe = Recipe.objects.create(
-            author=author,
-            name=name,
-            image=image,
-            text=text,
-            cooking_time=cooking_time,
-        )
-        recipe = self.add_tags_ingredients(tags, ingredients, recipe)
+        with transaction.atomic():
+            recipe = Recipe.objects.create(
+                author=author,
+                name=name,
+                image=image,
+                text=text,
+                cooking_time=cooking_time,
+                ingredients_count=len(ingredients),
+            )
+            recipe = self.add_tags_ingredients(tags, ingredients, recipe)
+            schedule_image_processing(recipe)
         return recipe
 
+    def update_ingredients(self, recipe, ingredients):
+        """Меняет только те строки IngredientRecipe, что изменились."""
+        amounts = {ingredient['ingredient']['id']: ingredient['amount']
+                   for ingredient in ingredients}
+        current = {row.ingredient_id: row
+                   for row in IngredientRecipe.objects.filter(recipe=recipe)}
+        IngredientRecipe.objects.filter(
+            recipe=recipe, ingredient_id__in=current.keys() - amounts.keys()
+        ).delete()
+        changed = []
+        for ingredient_id, row in current.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and row.amount != amount:
+                row.amount = amount
+                changed.append(row)
+        IngredientRecipe.objects.bulk_update(changed, ['amount'])
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(recipe=recipe, ingredient_id=ingredient_id,
+                             amount=amount)
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in current)
+
+    def to_representation(self, instance):
+        prefetch_related_objects([instance], Prefetch(
+            'ingredient_recipes',
+            queryset=IngredientRecipe.objects.select_related('ingredient')))
+        return super().to_representation(instance)
+
     def update(self, instance, validated_data):
-        tags = validated_data.pop('tags')
-        ingredients = validated_data.pop('ingredient_recipes')
-        TagRecipe.objects.filter(recipe=instance).delete()
-        IngredientRecipe.objects.filter(recipe=instance).delete()
-        instance = self.add_tags_ingredients(tags, ingredients, instance)
-        super().update(instance, validated_data)
-        instance.save()
+        tags = validated_data.pop('tags', None)
+        ingredients = validated_data.pop('ingredient_recipes', None)
+        if 'image' in validated_data:
+            # Старые копии относятся к прежней картинке.
+            validated_data['image_variants'] = {}
+        with transaction.atomic():
+            if tags is not None:
+                instance.tags.set(tags)
+            if ingredients is not None:
+                ShoppingListItem.objects.apply_recipe(instance, -1)
+                self.update_ingredients(instance, ingredients)
+                ShoppingListItem.objects.apply_recipe(instance, 1)
+                validated_data['ingredients_count'] = len(ingredients)
+            old_variants = instance.image_variants
+            super().update(instance, validated_data)
+            if 'image' in validated_data:
+                delete_variants(old_variants)
+                schedule_image_processing(instance)
         return instance
 
 
+class BulkIdsSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1, max_value=MAX_ID),
+        allow_empty=False, max_length=settings.BULK_MAX_IDS)
+
+
 class FavoriteSerializer(serializers.Serializer):
     id = serializers.IntegerField()
     name = serializers.CharField()
@@ -191,14 +514,14 @@ class RecipesCountSerializer(metaclass=serializers.SerializerMetaclass):
     recipes_count = serializers.SerializerMethodField()
 
     def get_recipes_count(self, obj):
-        return Recipe.objects.filter(author__id=obj.id).count()
+        return obj.recipes_count
 
 
-class ShortRecipeSerializer(serializers.ModelSerializer):
+class ShortRecipeSerializer(serializers.ModelSerializer, ImageVariants):
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'images', 'cooking_time')
 
 
 class UserFollowSerializer(serializers.ModelSerializer):
@@ -207,29 +530,12 @@ class UserFollowSerializer(serializers.ModelSerializer):
         model = Follow
         fields = ('user', 'author')
 
-    def validate(self, data):
-        user_id = data['user']
-        author_id = data['author']
-        is_following = Follow.objects.filter(
-            user=user_id, author=author_id
-        ).exists()
-        if is_following:
-            raise serializers.ValidationError(
-                'Вы уже подписаны.')
-        if (data['user'] == data['author']
-                and self.context['request'].method == 'POST'):
-            raise serializers.ValidationError(
-                'Нельзя подписаться на самого себя')
-        return data
-
     def to_representation(self, instance):
-        request = self.context.get('request')
-        obj = instance
-        if request.method == 'POST':
-            obj = instance.get('author')
+        # Подписка создаётся в FollowViewSet.create через add_relations,
+        # а здесь выводятся авторы из списка подписок.
         return FollowRepresentSerializer(
-            obj,
-            context={'request': request}
+            instance,
+            context={'request': self.context.get('request')}
         ).data
 
 
@@ -243,11 +549,10 @@ class FollowRepresentSerializer(serializers.ModelSerializer,
                   'is_subscribed', 'recipes', 'recipes_count')
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        if request.GET.get('recipes_limit'):
-            recipes_limit = int(request.GET.get('recipes_limit'))
-            queryset = Recipe.objects.filter(
-                author__id=obj.id).order_by('id')[:recipes_limit]
-        else:
-            queryset = Recipe.objects.filter(author__id=obj.id).order_by('id')
+        if hasattr(obj, 'recipes_preview'):
+            return ShortRecipeSerializer(obj.recipes_preview, many=True).data
+        recipes_limit = get_recipes_limit(self.context.get('request'))
+        queryset = Recipe.objects.filter(author__id=obj.id).order_by('id')
+        if recipes_limit is not None:
+            queryset = queryset[:recipes_limit]
         return ShortRecipeSerializer(queryset, many=True).data
@@ -0,0 +1,74 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from recipes.models import (Favorites, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingCart, Tag, TagRecipe)
+from users.models import CustomUser, Follow
+from .autocomplete import ingredient_index
+from .cache import invalidate
+from .feed import drop_timeline, fan_out
+from .images import delete_variants
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredients(sender, **kwargs):
+    ingredient_index.invalidate()
+    invalidate('ingredients', 'recipes')
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tags_cache(sender, **kwargs):
+    invalidate('tags', 'recipes')
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=TagRecipe)
+@receiver(post_delete, sender=TagRecipe)
+@receiver(post_save, sender=IngredientRecipe)
+@receiver(post_delete, sender=IngredientRecipe)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipes_cache(sender, **kwargs):
+    invalidate('recipes')
+
+
+@receiver(post_save, sender=CustomUser)
+def invalidate_recipes_cache_on_author_change(sender, update_fields=None,
+                                              **kwargs):
+    # Вход пользователя обновляет только last_login, а в рецептах автор
+    # выводится без него.
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+    invalidate('recipes')
+
+
+@receiver(post_save, sender=Favorites)
+@receiver(post_delete, sender=Favorites)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_user_version(sender, instance, **kwargs):
+    invalidate(f'user:{instance.user_id}')
+
+
+@receiver(post_delete, sender=Recipe)
+def delete_recipe_variants(sender, instance, **kwargs):
+    delete_variants(instance.image_variants)
+
+
+@receiver(post_save, sender=Recipe)
+def add_recipe_to_feeds(sender, instance, created, **kwargs):
+    if created:
+        recipe_id, author_id = instance.pk, instance.author_id
+        transaction.on_commit(lambda: fan_out(recipe_id, author_id))
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def drop_follower_timeline(sender, instance, **kwargs):
+    user_id = instance.user_id
+    transaction.on_commit(lambda: drop_timeline(user_id))
@@ -3,9 +3,10 @@ from django.urls import path
 from rest_framework.routers import DefaultRouter
 
 from users.views import CustomUserViewSet
-from .views import (DownloadShoppingCartViewSet, FavoriteViewSet,
-                    FollowViewSet, IngredientViewSet, RecipeViewSet,
-                    ShoppingCartViewSet, TagViewSet)
+from .views import (BulkFavoriteViewSet, BulkFollowViewSet,
+                    BulkShoppingCartViewSet, DownloadShoppingCartViewSet,
+                    FavoriteViewSet, FollowViewSet, IngredientViewSet,
+                    RecipeViewSet, ShoppingCartViewSet, TagViewSet)
 
 
 app_name = 'api'
@@ -21,6 +22,20 @@ urlpatterns = [
     path('recipes/download_shopping_cart/',
          DownloadShoppingCartViewSet.as_view({'get': 'download_shopping_cart'}
                                              ), name='download'),
+    path('recipes/favorite/',
+         BulkFavoriteViewSet.as_view({'post': 'create',
+                                      'delete': 'delete'}),
+         name='favorite_bulk'),
+    path('recipes/shopping_cart/',
+         BulkShoppingCartViewSet.as_view({'post': 'create',
+                                          'delete': 'delete'}),
+         name='shoppingcart_bulk'),
+    path('recipes/shopping_cart/clear/',
+         BulkShoppingCartViewSet.as_view({'delete': 'clear'}),
+         name='shoppingcart_clear'),
+    path('users/subscribe/',
+         BulkFollowViewSet.as_view({'post': 'create', 'delete': 'delete'}),
+         name='subscribe_bulk'),
     path('users/subscriptions/',
          FollowViewSet.as_view({'get': 'list'}), name='subscriptions'),
     path('users/<user_id>/subscribe/',
@@ -1,27 +1,110 @@
-from django.db.models import Sum
+import csv
+import json
+from decimal import Decimal
 
-from recipes.models import IngredientRecipe
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from rest_framework.exceptions import ValidationError
+
+from recipes.models import Recipe, ShoppingListItem
+
+# Наибольший id: первичные ключи — BigAutoField.
+MAX_ID = 2 ** 63 - 1
 
 
 def get_wishlist(user):
-    shopping_list = {}
-    ingredients = IngredientRecipe.objects.filter(
-        recipe__shopping_cart__user=user).values(
-            'ingredient__name',
-            'ingredient__measurement_unit'
-    ).annotate(amount=Sum('amount'))
-    for ingredient in ingredients:
-        amount = ingredient['amount']
-        name = ingredient['ingredient__name']
-        measurement_unit = ingredient['ingredient__measurement_unit']
-        if name not in shopping_list:
-            shopping_list[name] = {
-                'measurement_unit': measurement_unit,
-                'amount': amount
-            }
-        else:
-            shopping_list[name]['amount'] += ingredient.amount__sum
-    wishlist = ([f'{item} - {value["amount"]} '
-                 f'{value["measurement_unit"]} \n'
-                 for item, value in shopping_list.items()])
-    return wishlist
+    """Сохранённый список покупок пользователя."""
+    return ShoppingListItem.objects.filter(user=user).values(
+        'name', unit=F('measurement_unit'), total=F('amount')
+    ).order_by('name', 'unit')
+
+
+def format_amount(amount):
+    return f'{Decimal(str(amount)).normalize():f}'
+
+
+class Echo:
+    """Псевдо-буфер: csv.writer пишет в него, а строка сразу отдаётся."""
+
+    def write(self, value):
+        return value
+
+
+def wishlist_txt(rows):
+    for row in rows:
+        yield (f'{row["name"]} - {format_amount(row["total"])} '
+               f'{row["unit"]} \n')
+
+
+def wishlist_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('Ингредиент', 'Количество', 'Единица'))
+    for row in rows:
+        yield writer.writerow(
+            (row['name'], format_amount(row['total']), row['unit']))
+
+
+def wishlist_json(rows):
+    yield '['
+    separator = ''
+    for row in rows:
+        yield separator + json.dumps({
+            'name': row['name'],
+            'amount': format_amount(row['total']),
+            'measurement_unit': row['unit'],
+        }, ensure_ascii=False)
+        separator = ','
+    yield ']'
+
+
+WISHLIST_FORMATS = {
+    'txt': (wishlist_txt, 'text/plain; charset=utf-8'),
+    'csv': (wishlist_csv, 'text/csv; charset=utf-8'),
+    'json': (wishlist_json, 'application/json'),
+}
+
+
+def parse_id(value):
+    """Неотрицательное целое из строки или None. Числа больше MAX_ID
+    не поместились бы в параметр запроса к БД."""
+    # isdecimal, а не isdigit: '²' — цифра, но int() её не разберёт.
+    if not value.isdecimal() or int(value) > MAX_ID:
+        return None
+    return int(value)
+
+
+def get_recipes_limit(request):
+    """Неотрицательное число из ?recipes_limit или None, если его нет."""
+    value = request.query_params.get('recipes_limit')
+    if not value:
+        return None
+    recipes_limit = parse_id(value)
+    if recipes_limit is None:
+        raise ValidationError({'recipes_limit': [
+            'Укажите неотрицательное целое число.']})
+    return recipes_limit
+
+
+def prefetch_recipes_preview(authors, recipes_limit=None):
+    """Одним запросом кладёт в author.recipes_preview первые recipes_limit
+    рецептов каждого автора страницы подписок."""
+    authors = list(authors)
+    if not authors:
+        # Пустой IN в подзапросе с окном не компилируется в SQL.
+        return
+    recipes = Recipe.objects.filter(
+        author__in=[author.id for author in authors]).order_by('id')
+    if recipes_limit is not None:
+        ranked = recipes.annotate(row_number=Window(
+            RowNumber(), partition_by=[F('author')],
+            order_by=F('id').asc())).order_by()
+        sql, params = ranked.query.sql_with_params()
+        recipes = Recipe.objects.raw(
+            f'SELECT * FROM ({sql}) ranked '
+            f'WHERE ranked.row_number <= %s ORDER BY ranked.id',
+            (*params, recipes_limit))
+    by_author = {author.id: [] for author in authors}
+    for recipe in recipes:
+        by_author[recipe.author_id].append(recipe)
+    for author in authors:
+        author.recipes_preview = by_author[author.id]
@@ -1,20 +1,35 @@
-from django.http import HttpResponse
-from django.shortcuts import get_list_or_404, get_object_or_404
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Value
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_cache_control
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 
 from recipes.models import Favorites, Ingredient, Recipe, ShoppingCart, Tag
 from users.models import CustomUser, Follow
+from .autocomplete import ingredient_index
+from .bulk import add_relations, bulk_add, bulk_remove, remove_relations
+from .cache import cache_response, conditional_response
+from .feed import feed_queryset
 from .filters import IngredientSearchFilter, RecipeFilters
-from .pagination import LimitPageNumberPagination
+from .pagination import (CursorOrPageNumberPagination,
+                         LimitCursorPagination, LimitPageNumberPagination)
 from .permissions import IsOwnerOrReadOnly
-from .serializers import (FavoriteSerializer, IngredientSerializer,
+from .serializers import (BulkIdsSerializer, FavoriteSerializer,
+                          FlatIngredientSerializer, FlatRecipeSerializer,
+                          FlatTagSerializer, FollowRepresentSerializer,
+                          IngredientSerializer, RecipeMatchSerializer,
                           RecipeSerializer, RecipeSerializerPost,
                           ShoppingCartSerializer, TagSerializer,
                           UserFollowSerializer)
-from .utils import get_wishlist
+from .utils import (WISHLIST_FORMATS, get_recipes_limit, get_wishlist,
+                    parse_id, prefetch_recipes_preview)
 
 
 class IngredientViewSet(viewsets.ModelViewSet):
@@ -25,24 +40,200 @@ class IngredientViewSet(viewsets.ModelViewSet):
     filter_backends = (DjangoFilterBackend, IngredientSearchFilter)
     search_fields = ['^name', ]
 
+    def use_flat_serializer(self):
+        # Подсказки по name — до INGREDIENT_SEARCH_LIMIT экземпляров
+        # Ingredient из индекса, для них выигрыша нет.
+        return (settings.FLAT_SERIALIZERS and self.action == 'list'
+                and not self.request.query_params.get('name'))
+
+    def get_queryset(self):
+        if self.use_flat_serializer():
+            return Ingredient.objects.values(*FlatIngredientSerializer.columns)
+        return super().get_queryset()
+
+    def get_serializer_class(self):
+        if self.use_flat_serializer():
+            return FlatIngredientSerializer
+        return IngredientSerializer
+
+    @conditional_response('ingredients')
+    @cache_response('ingredients')
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if not name:
+            return super().list(request, *args, **kwargs)
+        try:
+            limit = min(int(request.query_params['limit']),
+                        settings.INGREDIENT_SEARCH_LIMIT)
+        except (KeyError, ValueError):
+            limit = settings.INGREDIENT_SEARCH_LIMIT
+        if settings.INGREDIENT_AUTOCOMPLETE_INDEX:
+            ingredients = ingredient_index.search(name, limit)
+        else:
+            # Названия в справочнике хранятся в нижнем регистре, поэтому
+            # регистрозависимый префикс попадает в ingredient_name_prefix_idx.
+            ingredients = Ingredient.objects.filter(
+                name__startswith=name.lower()).order_by('name')[:limit]
+        serializer = self.get_serializer(ingredients, many=True)
+        response = Response(serializer.data)
+        patch_cache_control(response, public=True,
+                            max_age=settings.INGREDIENT_INDEX_TTL)
+        return response
+
+    @conditional_response('ingredients')
+    @cache_response('ingredients')
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
 
 class TagViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
 
+    def use_flat_serializer(self):
+        return settings.FLAT_SERIALIZERS and self.action == 'list'
+
+    def get_queryset(self):
+        if self.use_flat_serializer():
+            return Tag.objects.values(*FlatTagSerializer.columns)
+        return super().get_queryset()
+
+    def get_serializer_class(self):
+        if self.use_flat_serializer():
+            return FlatTagSerializer
+        return TagSerializer
+
+    @conditional_response('tags')
+    @cache_response('tags')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_response('tags')
+    @cache_response('tags')
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
 
 class RecipeViewSet(viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     permission_classes = (IsOwnerOrReadOnly,)
-    pagination_class = LimitPageNumberPagination
+    pagination_class = CursorOrPageNumberPagination
+    # Курсор упорядочил бы найденные рецепты по id, а не по релевантности.
+    page_number_params = ('search',)
     filterset_class = RecipeFilters
     filter_backends = [DjangoFilterBackend, ]
 
+    def get_fieldset(self):
+        """Поля ответа из ?fields=a,b и вложенные объекты, которые
+        выводятся целиком, из ?expand=c,d. Без fields или с пустым
+        fields — все поля."""
+        params = self.request.query_params
+        if self.request.method != 'GET' or 'fields' not in params:
+            return None, ()
+        serializer_class = (RecipeMatchSerializer if self.action == 'match'
+                            else RecipeSerializer)
+        fields = set(filter(None, params['fields'].split(',')))
+        expand = set(filter(None, params.get('expand', '').split(',')))
+        errors = {}
+        for name, values, allowed in (
+                ('fields', fields, serializer_class.Meta.fields),
+                ('expand', expand, serializer_class.collapsed_fields)):
+            unknown = ', '.join(sorted(values.difference(allowed)))
+            if unknown:
+                errors[name] = [f'Неизвестные поля: {unknown}']
+        if errors:
+            raise ValidationError(errors)
+        if not fields:
+            return None, ()
+        return fields, expand
+
+    def use_flat_serializer(self):
+        return settings.FLAT_SERIALIZERS and self.action in ('list', 'feed')
+
+    def get_queryset(self):
+        fields, expand = self.get_fieldset()
+        if self.use_flat_serializer():
+            return Recipe.objects.values(
+                *FlatRecipeSerializer.get_columns(fields))
+        if fields is not None and self.action == 'match':
+            # Доля и недостающие ингредиенты считаются по строкам рецепта.
+            fields = fields | {'ingredients'}
+            expand = expand | {'ingredients'}
+        return Recipe.objects.with_related(fields, expand)
+
+    def get_serializer_context(self):
+        fields, expand = self.get_fieldset()
+        return {**super().get_serializer_context(),
+                'fields': fields, 'expand': expand}
+
+    @conditional_response('recipes', per_user=True)
+    @cache_response('recipes', anonymous_only=True)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_response('recipes', per_user=True)
+    @cache_response('recipes', anonymous_only=True)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    # Курсор упорядочил бы рецепты по id, а не по доле ингредиентов.
+    @action(detail=False, url_path='match',
+            pagination_class=LimitPageNumberPagination)
+    @conditional_response('recipes', per_user=True)
+    @cache_response('recipes', anonymous_only=True)
+    def match(self, request):
+        """Что приготовить из имеющегося: ?ingredients=1&ingredients=2."""
+        try:
+            ingredients = {int(value) for value in
+                           request.query_params.getlist('ingredients')}
+        except ValueError:
+            message = 'Ингредиенты задаются числовыми id'
+            return Response(message, status=status.HTTP_400_BAD_REQUEST)
+        if not ingredients:
+            message = 'Укажите хотя бы один ингредиент'
+            return Response(message, status=status.HTTP_400_BAD_REQUEST)
+        queryset = self.filter_queryset(
+            self.get_queryset()).match_ingredients(ingredients)
+        page = self.paginate_queryset(queryset)
+        serializer = RecipeMatchSerializer(page, many=True, context={
+            **self.get_serializer_context(), 'ingredients': ingredients})
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, permission_classes=(permissions.IsAuthenticated,))
+    @conditional_response('recipes', per_user=True)
+    def feed(self, request):
+        """Рецепты авторов из подписок, от новых к старым."""
+        queryset = feed_queryset(
+            self.filter_queryset(self.get_queryset()), request.user.id)
+        paginator = LimitCursorPagination()
+        page = paginator.paginate_queryset(queryset, request, self)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        search = self.request.query_params.get('search')
+        if page is not None and search:
+            # Сниппеты считаются только для страницы, а не для всех
+            # найденных рецептов при подсчёте count.
+            flat = self.use_flat_serializer()
+            ids = [recipe['id'] if flat else recipe.id for recipe in page]
+            headlines = dict(Recipe.objects.filter(
+                id__in=ids).search_headlines(search))
+            for recipe, recipe_id in zip(page, ids):
+                if flat:
+                    recipe['search_headline'] = headlines[recipe_id]
+                else:
+                    recipe.search_headline = headlines[recipe_id]
+        return page
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
     def get_serializer_class(self):
+        if self.use_flat_serializer():
+            return FlatRecipeSerializer
         if self.request.method == 'GET':
             return RecipeSerializer
         return RecipeSerializerPost
@@ -54,21 +245,19 @@ class BaseFavoriteCartViewSet(viewsets.ModelViewSet):
     def create(self, request, *args, **kwargs):
         recipe_id = self.kwargs['recipe_id']
         recipe = get_object_or_404(Recipe, id=recipe_id)
-        if self.model.objects.filter(user=request.user,
-                                     recipe=recipe).exists():
+        # Ответ определяется тем, вставил ли строку INSERT ... ON CONFLICT
+        # DO NOTHING: повторный клик не приведёт к IntegrityError.
+        if not add_relations(self.model, request.user.id, [recipe.id]):
             message = 'Вы уже добавили этот рецепт'
             return Response(message, status=status.HTTP_400_BAD_REQUEST)
-        self.model.objects.create(
-            user=request.user, recipe=recipe)
         serializer = self.get_serializer(recipe)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def delete(self, request, *args, **kwargs):
-        recipe_id = self.kwargs['recipe_id']
-        user_id = request.user.id
-        object = get_object_or_404(
-            self.model, user__id=user_id, recipe__id=recipe_id)
-        object.delete()
+        recipe_id = parse_id(self.kwargs['recipe_id'])
+        if recipe_id is None or not remove_relations(
+                self.model, request.user.id, [recipe_id]):
+            raise Http404
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -84,47 +273,105 @@ class ShoppingCartViewSet(BaseFavoriteCartViewSet):
     model = ShoppingCart
 
 
+class BaseBulkViewSet(viewsets.GenericViewSet):
+    """Пакетное добавление и удаление по списку id: {"ids": [1, 2]}.
+    В ответе статус каждого id."""
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = BulkIdsSerializer
+
+    def get_ids(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data['ids']
+
+    def bulk_response(self, statuses):
+        return Response({'results': [
+            {'id': object_id, 'status': state}
+            for object_id, state in statuses.items()]})
+
+    def create(self, request, *args, **kwargs):
+        return self.bulk_response(
+            bulk_add(self.model, request.user.id, self.get_ids(request)))
+
+    def delete(self, request, *args, **kwargs):
+        return self.bulk_response(
+            bulk_remove(self.model, request.user.id, self.get_ids(request)))
+
+
+class BulkFavoriteViewSet(BaseBulkViewSet):
+    model = Favorites
+
+
+class BulkShoppingCartViewSet(BaseBulkViewSet):
+    model = ShoppingCart
+
+    def clear(self, request, *args, **kwargs):
+        return self.bulk_response(bulk_remove(self.model, request.user.id))
+
+
+class BulkFollowViewSet(BaseBulkViewSet):
+    model = Follow
+
+
 class DownloadShoppingCartViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
     @action(detail=False, methods=('get',), url_path='download_shopping_cart')
     def download_shopping_cart(self, request):
+        file_format = request.query_params.get('file_format', 'txt')
+        if file_format not in WISHLIST_FORMATS:
+            message = f'Неизвестный формат файла: {file_format}'
+            return Response(message, status=status.HTTP_400_BAD_REQUEST)
+        render, content_type = WISHLIST_FORMATS[file_format]
         wishlist = get_wishlist(request.user)
-        response = HttpResponse(wishlist, 'Content-Type: text/plain')
-        response['Content-Disposition'] = 'attachment; filename="shoplist.txt"'
+        if isinstance(request._request, ASGIRequest):
+            # Под ASGI потоковый ответ читается в цикле событий, где
+            # запросы к БД запрещены, поэтому строки читаются здесь.
+            wishlist = list(wishlist)
+        else:
+            wishlist = wishlist.iterator()
+        response = StreamingHttpResponse(render(wishlist),
+                                         content_type=content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename="shoplist.{file_format}"')
         return response
 
 
 class FollowViewSet(viewsets.ModelViewSet):
     serializer_class = UserFollowSerializer
     permission_classes = [permissions.IsAuthenticated]
-    pagination_class = LimitPageNumberPagination
+    pagination_class = CursorOrPageNumberPagination
+    cursor_ordering = 'id'
 
     def get_queryset(self):
-        return get_list_or_404(CustomUser, following__user=self.request.user)
+        return CustomUser.objects.filter(
+            following__user=self.request.user
+        ).annotate(is_subscribed=Value(True)).order_by('id')
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        if page is not None:
+            prefetch_recipes_preview(page, get_recipes_limit(self.request))
+        return page
 
     def create(self, request, *args, **kwargs):
         user_id = self.kwargs.get('user_id')
+        # Ошибка в recipes_limit должна прийти до подписки, а не после.
+        get_recipes_limit(request)
         author = get_object_or_404(CustomUser, id=user_id)
-        data = {
-            'user': request.user.id,
-            'author': user_id
-        }
-        serializer = UserFollowSerializer(data=data,
-                                          context={'request': request})
-        if not serializer.is_valid():
-            return Response(
-                serializer.errors,
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        Follow.objects.get_or_create(
-            user=request.user, author=author)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        if author.id == request.user.id:
+            message = 'Нельзя подписаться на самого себя'
+        elif not add_relations(Follow, request.user.id, [author.id]):
+            message = 'Вы уже подписаны.'
+        else:
+            serializer = FollowRepresentSerializer(
+                author, context={'request': request})
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response({api_settings.NON_FIELD_ERRORS_KEY: [message]},
+                        status=status.HTTP_400_BAD_REQUEST)
 
     def delete(self, request, *args, **kwargs):
-        author_id = self.kwargs.get('user_id')
-        user_id = request.user.id
-        Follow.objects.filter(
-            user__id=user_id, author__id=author_id
-        ).delete()
+        author_id = parse_id(self.kwargs.get('user_id'))
+        if author_id is not None:
+            remove_relations(Follow, request.user.id, [author_id])
         return Response(status=status.HTTP_204_NO_CONTENT)
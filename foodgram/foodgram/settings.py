@@ -40,6 +40,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.SQLProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -95,6 +96,39 @@ DATABASES = {
 AUTH_USER_MODEL = 'users.CustomUser'
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+
+CACHE_BACKEND = os.getenv(
+    'CACHE_BACKEND', 'django.core.cache.backends.redis.RedisCache')
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv('CACHE_LOCATION', 'redis://redis:6379/1'),
+    }
+}
+
+# Кеш в памяти процесса не общий для воркеров gunicorn: новая версия
+# данных видна только процессу, который обработал изменение. С таким
+# кешем ответы, ETag, наборы пользователя, ленты и теги не кешируются.
+SHARED_CACHE = CACHE_BACKEND not in (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+RESPONSE_CACHE_TIMEOUT = 60 * 10
+
+# ETag и Last-Modified строятся по версиям данных из кеша. С кешем
+# в памяти процесса другой воркер не увидел бы изменений и ответил бы 304
+# на устаревшие данные, поэтому они включены только с общим кешем.
+CONDITIONAL_GET = SHARED_CACHE
+
+# Списки рецептов, тегов и ингредиентов читаются через .values() и
+# собираются плоскими сериализаторами без экземпляров моделей и полей DRF.
+FLAT_SERIALIZERS = True
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -149,6 +183,10 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.TokenAuthentication',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
 
@@ -174,3 +212,54 @@ MEDIA_URL = '/foodgram_media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'foodgram_media')
 
 PAGE_SIZE = 6
+
+# Автодополнение ингредиентов: индекс в памяти процесса, время жизни
+# индекса в секундах и максимальное число подсказок.
+INGREDIENT_AUTOCOMPLETE_INDEX = True
+INGREDIENT_INDEX_TTL = 300
+INGREDIENT_SEARCH_LIMIT = 20
+
+# Картинки рецептов: ширины уменьшенных копий, число потоков пула
+# обработки (0 — обрабатывать прямо в запросе), предельный размер
+# загружаемого файла в байтах и число пикселей, которое можно распаковать.
+RECIPE_IMAGE_WIDTHS = (320, 640, 1280)
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+IMAGE_UPLOAD_MAX_BYTES = 10 * 1024 * 1024
+IMAGE_MAX_PIXELS = 40_000_000
+
+# Сколько id можно передать в пакетные эндпоинты избранного, корзины
+# и подписок.
+BULK_MAX_IDS = 100
+
+# Лента подписок: сколько последних рецептов хранится в ленте
+# пользователя, время жизни ленты в кеше в секундах и число подписчиков,
+# начиная с которого рецепты автора не раскладываются по лентам,
+# а добираются при чтении.
+FEED_SIZE = 500
+FEED_TIMEOUT = 60 * 60
+FEED_FANOUT_MAX_FOLLOWERS = int(os.getenv('FEED_FANOUT_MAX_FOLLOWERS', 1000))
+
+# Профилирование запросов: заголовки Server-Timing/X-Query-Count
+# и порог в миллисекундах для записи медленных запросов в лог.
+SQL_PROFILING_HEADERS = os.getenv('SQL_PROFILING_HEADERS') == 'True'
+SLOW_REQUEST_MS = int(os.getenv('SLOW_REQUEST_MS', 500))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'foodgram.performance': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+        'foodgram.images': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+    },
+}
@@ -0,0 +1,18 @@
+import multiprocessing
+import os
+
+# SERVER_MODE=wsgi — синхронные воркеры с потоками (gthread),
+# SERVER_MODE=asgi — воркеры uvicorn поверх foodgram.asgi.
+mode = os.getenv('SERVER_MODE', 'wsgi')
+
+bind = '0:8000'
+workers = int(os.getenv('GUNICORN_WORKERS',
+                        multiprocessing.cpu_count() * 2 + 1))
+
+if mode == 'asgi':
+    wsgi_app = 'foodgram.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'foodgram.wsgi:application'
+    worker_class = 'gthread'
+    threads = int(os.getenv('GUNICORN_THREADS', 4))
@@ -2,7 +2,7 @@ from django.contrib import admin
 
 from users.models import CustomUser, Follow
 from .models import (Favorites, Ingredient, IngredientRecipe, Recipe,
-                     ShoppingCart, Tag, TagRecipe)
+                     ShoppingCart, ShoppingListItem, Tag, TagRecipe)
 
 
 class IngredientRecipeInline(admin.TabularInline):
@@ -39,8 +39,20 @@ class RecipeAdmin(admin.ModelAdmin):
     list_filter = ('author', 'name', 'tags')
 
     def count_favorite(self, obj):
-        return Favorites.objects.filter(recipe=obj).count()
+        return obj.favorites_count
     count_favorite.short_description = 'Количество добавлений в избранное'
+    count_favorite.admin_order_field = 'favorites_count'
+
+    def save_related(self, request, form, formsets, change):
+        recipe = form.instance
+        # Ингредиенты рецепта из inline входят в списки покупок тех,
+        # у кого рецепт в корзине: старые вычитаются, новые прибавляются.
+        if change:
+            ShoppingListItem.objects.apply_recipe(recipe, -1)
+        super().save_related(request, form, formsets, change)
+        ShoppingListItem.objects.apply_recipe(recipe, 1)
+        recipe.ingredients_count = recipe.ingredient_recipes.count()
+        recipe.save(update_fields=['ingredients_count'])
 
 
 class ShoppingCartAdmin(admin.ModelAdmin):
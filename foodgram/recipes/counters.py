@@ -0,0 +1,38 @@
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from users.models import CustomUser, Follow
+from .models import Favorites, IngredientRecipe, Recipe, ShoppingCart
+
+# Модель, поле-счётчик, модель строк и её внешний ключ на владельца счётчика.
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorites, 'recipe'),
+    (Recipe, 'in_carts_count', ShoppingCart, 'recipe'),
+    (Recipe, 'ingredients_count', IngredientRecipe, 'recipe'),
+    (CustomUser, 'recipes_count', Recipe, 'author'),
+    (CustomUser, 'followers_count', Follow, 'author'),
+)
+
+
+def actual_count(model, field):
+    rows = model.objects.filter(
+        **{field: OuterRef('pk')}
+    ).order_by().values(field).annotate(count=Count('pk')).values('count')
+    return Coalesce(Subquery(rows), Value(0))
+
+
+def reconcile(dry_run=False):
+    """Сверяет счётчики с реальным числом строк и исправляет расхождения.
+
+    Возвращает число разошедшихся записей для каждого счётчика.
+    """
+    drift = {}
+    for model, counter, rows_model, field in COUNTERS:
+        drifted = model.objects.annotate(
+            actual=actual_count(rows_model, field)
+        ).exclude(**{counter: F('actual')})
+        drift[f'{model.__name__}.{counter}'] = drifted.count()
+        if not dry_run:
+            model.objects.filter(pk__in=drifted.values('pk')).update(
+                **{counter: actual_count(rows_model, field)})
+    return drift
@@ -1,7 +1,22 @@
+from decimal import Decimal
+
+from django.contrib.postgres.search import (SearchHeadline, SearchQuery,
+                                            SearchRank, SearchVectorField)
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models import (Case, Count, DecimalField, F, FloatField,
+                              Prefetch, Q, Sum, TextField, Value, When)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast, Concat, Greatest, Replace
 
 from users.models import CustomUser
+from .search import SEARCH_CONFIG, START_SEL, STOP_SEL
+
+# Единицы, которые в списке покупок приводятся к базовым.
+UNIT_CONVERSIONS = {
+    'кг': ('г', 1000),
+    'л': ('мл', 1000),
+}
 
 
 class Ingredient(models.Model):
@@ -14,6 +29,19 @@ class Ingredient(models.Model):
         max_length=14,
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient'
+            ),
+        ]
+        indexes = [
+            # Для LIKE 'префикс%' в Postgres с не-C локалью.
+            models.Index(fields=['name'], name='ingredient_name_prefix_idx',
+                         opclasses=['varchar_pattern_ops']),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -46,10 +74,109 @@ class Tag(models.Model):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+    def with_related(self, fields=None, expand=()):
+        """Подгружает связи RecipeSerializer без запросов на каждый рецепт.
+
+        fields — поля ответа (None — все), expand — вложенные объекты,
+        которые выводятся целиком, а не id. Связи, которых нет в ответе,
+        не подгружаются, а описание и копии картинки не читаются.
+        Флаги избранного, корзины и подписки берутся не из подзапросов,
+        а из наборов id пользователя (api.interactions).
+        """
+        def wanted(name):
+            return fields is None or name in fields
+
+        def expanded(name):
+            return fields is None or (name in fields and name in expand)
+
+        # Теги и ингредиенты рецепта выводятся в постоянном порядке:
+        # теги по id, ингредиенты в порядке добавления.
+        lookups = []
+        if wanted('tags'):
+            lookups.append(Prefetch('tags', queryset=Tag.objects.order_by(
+                'id')))
+        if wanted('ingredients'):
+            rows = IngredientRecipe.objects.order_by('id')
+            if expanded('ingredients'):
+                rows = rows.select_related('ingredient')
+            lookups.append(Prefetch('ingredient_recipes', queryset=rows))
+        if expanded('author'):
+            lookups.append('author')
+        deferred = [field for field, name in (('text', 'text'),
+                                              ('image_variants', 'images'))
+                    if not wanted(name)]
+        return self.prefetch_related(*lookups).defer(*deferred)
+
+    def search(self, term):
+        """Полнотекстовый поиск по названию и описанию, рецепты
+        упорядочены по релевантности. Без Postgres поиск идёт
+        по вхождению каждого слова."""
+        if connections[self.db].vendor == 'postgresql':
+            query = SearchQuery(term, config=SEARCH_CONFIG,
+                                search_type='websearch')
+            return self.alias(search_vector=RawSQL(
+                'recipes_recipe.search_vector', [],
+                output_field=SearchVectorField())
+            ).filter(search_vector=query).alias(
+                search_rank=SearchRank(F('search_vector'), query)
+            ).order_by('-search_rank', '-id')
+        queryset = self
+        rank = Value(0.0)
+        for word in term.split():
+            queryset = queryset.filter(
+                Q(name__icontains=word) | Q(text__icontains=word))
+            rank = (rank
+                    + Case(When(name__icontains=word, then=Value(1.0)),
+                           default=Value(0.0))
+                    + Case(When(text__icontains=word, then=Value(0.4)),
+                           default=Value(0.0)))
+        return queryset.alias(search_rank=rank).order_by('-search_rank', '-id')
+
+    def match_ingredients(self, ingredient_ids):
+        """Рецепты, в которых есть хотя бы один из ингредиентов,
+        по убыванию доли найденных ингредиентов рецепта.
+
+        Соединение идёт только со связями найденных ингредиентов по
+        индексу (ingredient, recipe), а доля считается от счётчика
+        ingredients_count, без подсчёта всех ингредиентов рецепта.
+        """
+        return self.filter(
+            ingredient_recipes__ingredient_id__in=ingredient_ids,
+        ).alias(
+            matched_count=Count('ingredient_recipes'),
+        ).alias(
+            coverage=Cast('matched_count', FloatField()) / Greatest(
+                'ingredients_count', 'matched_count'),
+        ).order_by('-coverage', '-matched_count', '-id')
+
+    def search_headlines(self, term):
+        """Пары (id, фрагмент названия и описания, где совпадения
+        стоят между START_SEL и STOP_SEL)."""
+        document = Concat('name', Value('\n'), 'text',
+                          output_field=TextField())
+        if connections[self.db].vendor == 'postgresql':
+            headline = SearchHeadline(
+                document,
+                SearchQuery(term, config=SEARCH_CONFIG,
+                            search_type='websearch'),
+                config=SEARCH_CONFIG, start_sel=START_SEL,
+                stop_sel=STOP_SEL)
+        else:
+            headline = document
+            for word in term.split():
+                headline = Replace(headline, Value(word),
+                                   Value(f'{START_SEL}{word}{STOP_SEL}'),
+                                   output_field=TextField())
+        return self.annotate(search_headline=headline).values_list(
+            'id', 'search_headline')
+
+
 class Recipe(models.Model):
     author = models.ForeignKey(
         CustomUser,
         on_delete=models.CASCADE,
+        db_index=False,
         related_name='author_recipes',
         verbose_name='Автор',
         help_text='Автор'
@@ -95,9 +222,36 @@ class Recipe(models.Model):
         auto_now_add=True,
         verbose_name='Дата создания'
     )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='Количество добавлений в избранное',
+        default=0,
+        editable=False
+    )
+    in_carts_count = models.PositiveIntegerField(
+        verbose_name='Количество добавлений в корзину',
+        default=0,
+        editable=False
+    )
+    ingredients_count = models.PositiveIntegerField(
+        verbose_name='Количество ингредиентов',
+        default=0,
+        editable=False
+    )
+    image_variants = models.JSONField(
+        verbose_name='Уменьшенные копии картинки',
+        default=dict,
+        editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         ordering = ["-id"]
+        indexes = [
+            # Рецепты автора в порядке выдачи; заменяет индекс по author.
+            models.Index(fields=['author', '-id'],
+                         name='recipe_author_id_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -107,12 +261,14 @@ class TagRecipe(models.Model):
     tag = models.ForeignKey(
         Tag,
         on_delete=models.CASCADE,
+        db_index=False,
         verbose_name='Тэги',
         help_text='Выберите теги рецепта'
     )
     recipe = models.ForeignKey(
         Recipe,
         on_delete=models.CASCADE,
+        db_index=False,
         verbose_name='Рецепт',
         help_text='Выберите рецепт'
     )
@@ -124,15 +280,39 @@ class TagRecipe(models.Model):
                 name='unique_tag_recipe'
             ),
         ]
+        indexes = [
+            models.Index(fields=['recipe', 'tag'],
+                         name='tagrecipe_recipe_tag_idx'),
+        ]
 
     def __str__(self):
         return f'{self.tag} {self.recipe}'
 
 
+class IngredientRecipeQuerySet(models.QuerySet):
+    def shopping_totals(self, *fields):
+        """Суммы по ингредиентам с единицами, приведёнными к базовым."""
+        unit = Case(
+            *(When(ingredient__measurement_unit=source, then=Value(target))
+              for source, (target, _) in UNIT_CONVERSIONS.items()),
+            default=F('ingredient__measurement_unit'))
+        factor = Case(
+            *(When(ingredient__measurement_unit=source,
+                   then=Value(Decimal(ratio)))
+              for source, (_, ratio) in UNIT_CONVERSIONS.items()),
+            default=Value(Decimal(1)), output_field=DecimalField())
+        return self.values(
+            *fields, name=F('ingredient__name'), unit=unit
+        ).annotate(
+            total=Sum(F('amount') * factor, output_field=DecimalField())
+        ).order_by(*fields, 'name', 'unit')
+
+
 class IngredientRecipe(models.Model):
     recipe = models.ForeignKey(
         Recipe,
         on_delete=models.CASCADE,
+        db_index=False,
         related_name='ingredient_recipes',
         verbose_name='Рецепт',
         help_text='Выберите рецепт'
@@ -140,6 +320,7 @@ class IngredientRecipe(models.Model):
     ingredient = models.ForeignKey(
         Ingredient,
         on_delete=models.CASCADE,
+        db_index=False,
         related_name='ingredient_recipes',
         verbose_name='Ингредиенты',
         help_text='Добавьте продукты, необходимые по рецепту'
@@ -156,6 +337,8 @@ class IngredientRecipe(models.Model):
         ]
     )
 
+    objects = IngredientRecipeQuerySet.as_manager()
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
@@ -163,6 +346,10 @@ class IngredientRecipe(models.Model):
                 name='unique_ingredient_recipe'
             ),
         ]
+        indexes = [
+            models.Index(fields=['ingredient', 'recipe'],
+                         name='ingrecipe_ingredient_idx'),
+        ]
 
     def __str__(self):
         return f"{self.ingredient} {self.recipe}"
@@ -172,12 +359,14 @@ class Favorites(models.Model):
     user = models.ForeignKey(
         CustomUser,
         on_delete=models.CASCADE,
+        db_index=False,
         verbose_name='Пользователь',
         help_text='Выберите пользователя'
     )
     recipe = models.ForeignKey(
         Recipe,
         on_delete=models.CASCADE,
+        db_index=False,
         related_name='favorites',
         verbose_name='Рецепт',
         help_text='Выберите рецепт'
@@ -190,6 +379,12 @@ class Favorites(models.Model):
                 name='unique_favourite'
             ),
         ]
+        # Поиск по user обслуживает unique_favourite, по recipe — этот
+        # индекс, поэтому отдельные индексы внешних ключей не нужны.
+        indexes = [
+            models.Index(fields=['recipe', 'user'],
+                         name='favorite_recipe_user_idx'),
+        ]
 
     def __str__(self):
         return f'{self.user} -> {self.recipe}'
@@ -199,6 +394,7 @@ class ShoppingCart(models.Model):
     user = models.ForeignKey(
         CustomUser,
         on_delete=models.CASCADE,
+        db_index=False,
         related_name='shopping_cart',
         verbose_name='Пользователь',
         help_text='Выберите пользователя'
@@ -206,6 +402,7 @@ class ShoppingCart(models.Model):
     recipe = models.ForeignKey(
         Recipe,
         on_delete=models.CASCADE,
+        db_index=False,
         related_name='shopping_cart',
         verbose_name='Рецепт',
         help_text='Выберите рецепты для добавления в корзину'
@@ -218,3 +415,130 @@ class ShoppingCart(models.Model):
                 name='unique_shopping_cart'
             ),
         ]
+        indexes = [
+            models.Index(fields=['recipe', 'user'],
+                         name='cart_recipe_user_idx'),
+        ]
+
+
+class ShoppingListItemQuerySet(models.QuerySet):
+    def apply_recipe(self, recipe, sign, user_ids=None):
+        """Прибавляет (sign=1) или вычитает (sign=-1) ингредиенты рецепта
+        из списков покупок пользователей, у которых он в корзине."""
+        if user_ids is None:
+            user_ids = list(ShoppingCart.objects.filter(
+                recipe=recipe).values_list('user_id', flat=True))
+        self.apply_recipes([recipe], sign, user_ids)
+
+    def apply_recipes(self, recipes, sign, user_ids):
+        """Прибавляет или вычитает сумму ингредиентов всех рецептов
+        из списков покупок пользователей user_ids."""
+        totals = list(IngredientRecipe.objects.filter(
+            recipe__in=recipes).shopping_totals())
+        if not user_ids or not totals:
+            return
+        with transaction.atomic():
+            # Блокировка пользователей упорядочивает параллельные изменения
+            # одного и того же списка покупок.
+            list(CustomUser.objects.select_for_update().filter(
+                id__in=user_ids).values_list('id', flat=True))
+            items = {
+                (item.user_id, item.name, item.measurement_unit): item
+                for item in self.filter(
+                    user_id__in=user_ids,
+                    name__in={row['name'] for row in totals})
+            }
+            to_create, to_update, to_delete = [], [], []
+            for user_id in user_ids:
+                for row in totals:
+                    amount = sign * Decimal(str(row['total']))
+                    item = items.get((user_id, row['name'], row['unit']))
+                    if item is None:
+                        if amount > 0:
+                            to_create.append(ShoppingListItem(
+                                user_id=user_id, name=row['name'],
+                                measurement_unit=row['unit'],
+                                amount=amount))
+                        continue
+                    item.amount += amount
+                    if item.amount > 0:
+                        to_update.append(item)
+                    else:
+                        to_delete.append(item.id)
+            self.bulk_create(to_create)
+            self.bulk_update(to_update, ['amount'])
+            self.filter(id__in=to_delete).delete()
+
+    def expected(self, user_ids=None):
+        """Список покупок, посчитанный заново по корзинам."""
+        carts = IngredientRecipe.objects.filter(
+            recipe__shopping_cart__isnull=False)
+        if user_ids is not None:
+            carts = carts.filter(recipe__shopping_cart__user__in=user_ids)
+        return carts.shopping_totals('recipe__shopping_cart__user')
+
+    def rebuild(self, user_ids=None):
+        with transaction.atomic():
+            items = self.all()
+            if user_ids is not None:
+                items = items.filter(user_id__in=user_ids)
+            items.delete()
+            self.bulk_create(
+                (ShoppingListItem(user_id=row['recipe__shopping_cart__user'],
+                                  name=row['name'],
+                                  measurement_unit=row['unit'],
+                                  amount=row['total'])
+                 for row in self.expected(user_ids).iterator()),
+                batch_size=1000)
+
+    def inconsistent_users(self):
+        """Пользователи, чей сохранённый список покупок разошёлся
+        с корзиной."""
+        expected = {
+            (row['recipe__shopping_cart__user'], row['name'], row['unit'],
+             Decimal(str(row['total'])))
+            for row in self.expected().iterator()
+        }
+        stored = {
+            (row['user_id'], row['name'], row['measurement_unit'],
+             row['amount'])
+            for row in self.values(
+                'user_id', 'name', 'measurement_unit', 'amount').iterator()
+        }
+        return sorted({row[0] for row in expected ^ stored})
+
+
+class ShoppingListItem(models.Model):
+    user = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        db_index=False,
+        related_name='shopping_list',
+        verbose_name='Пользователь'
+    )
+    name = models.CharField(
+        verbose_name='Название ингредиента',
+        max_length=256
+    )
+    measurement_unit = models.CharField(
+        verbose_name='Единица измерения',
+        max_length=14
+    )
+    amount = models.DecimalField(
+        max_digits=14,
+        decimal_places=2,
+        verbose_name='Количество'
+    )
+
+    objects = ShoppingListItemQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'name', 'measurement_unit'],
+                name='unique_shopping_list_item'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.user}: {self.name} {self.amount}'
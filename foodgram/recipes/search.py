@@ -0,0 +1,39 @@
+from django.db import connections
+from django.utils.html import escape
+
+# Маркеры начала и конца совпадения в сниппете: не встречаются в тексте
+# и заменяются на теги уже после экранирования HTML.
+START_SEL = '\x02'
+STOP_SEL = '\x03'
+
+SEARCH_CONFIG = 'russian'
+
+# В Django 4.0 нет генерируемых полей, поэтому столбец и GIN-индекс
+# создаются после миграций и в модели не описаны: Django не пытается
+# писать в столбец, а Postgres сам пересчитывает его при любой записи,
+# включая bulk_create.
+CREATE_SEARCH_COLUMN = f"""
+ALTER TABLE recipes_recipe ADD COLUMN IF NOT EXISTS search_vector tsvector
+GENERATED ALWAYS AS (
+    setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(name, '')), 'A') ||
+    setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(text, '')), 'B')
+) STORED;
+CREATE INDEX IF NOT EXISTS recipe_search_vector_idx
+ON recipes_recipe USING gin (search_vector);
+"""
+
+
+def create_search_column(sender, using, **kwargs):
+    """Обработчик post_migrate: поисковый столбец нужен только Postgres,
+    в SQLite поиск идёт по LIKE."""
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(CREATE_SEARCH_COLUMN)
+
+
+def highlight(headline):
+    """Экранирует сниппет и оборачивает совпадения в <b>."""
+    return escape(headline).replace(
+        START_SEL, '<b>').replace(STOP_SEL, '</b>')
@@ -0,0 +1,116 @@
+from django.db.models import F
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from users.models import CustomUser, Follow
+from .counters import actual_count
+from .models import (Favorites, Ingredient, IngredientRecipe, Recipe,
+                     ShoppingCart, ShoppingListItem)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_to_shopping_list(sender, instance, created, **kwargs):
+    if created:
+        ShoppingListItem.objects.apply_recipe(
+            instance.recipe_id, 1, [instance.user_id])
+
+
+# pre_delete, а не post_delete: при каскадном удалении рецепта его
+# ингредиенты к моменту post_delete уже могут быть удалены.
+@receiver(pre_delete, sender=ShoppingCart)
+def remove_from_shopping_list(sender, instance, **kwargs):
+    ShoppingListItem.objects.apply_recipe(
+        instance.recipe_id, -1, [instance.user_id])
+
+
+def shopping_users(recipe_ids):
+    """Пользователи, у которых в корзине есть один из рецептов."""
+    return list(ShoppingCart.objects.filter(
+        recipe__in=recipe_ids).values_list('user_id', flat=True).distinct())
+
+
+@receiver(pre_save, sender=Ingredient)
+def collect_renamed_ingredient(sender, instance, **kwargs):
+    # Список покупок хранит название и единицу, поэтому при их смене
+    # списки с этим ингредиентом пересобираются в post_save.
+    old = Ingredient.objects.filter(pk=instance.pk).values(
+        'name', 'measurement_unit').first() if instance.pk else None
+    if old is None or old == {'name': instance.name,
+                              'measurement_unit': instance.measurement_unit}:
+        instance._shopping_users = None
+        return
+    instance._shopping_users = shopping_users(Recipe.objects.filter(
+        ingredient_recipes__ingredient=instance).values('id'))
+
+
+@receiver(post_save, sender=Ingredient)
+def rebuild_renamed_ingredient(sender, instance, **kwargs):
+    if getattr(instance, '_shopping_users', None):
+        ShoppingListItem.objects.rebuild(instance._shopping_users)
+
+
+@receiver(pre_delete, sender=Ingredient)
+def collect_ingredient_recipes(sender, instance, **kwargs):
+    # Строки рецептов с ингредиентом удалятся каскадом, поэтому рецепты
+    # и корзины, где они были, запоминаются заранее.
+    instance._recipe_ids = list(Recipe.objects.filter(
+        ingredient_recipes__ingredient=instance).values_list('id', flat=True))
+    instance._shopping_users = shopping_users(instance._recipe_ids)
+
+
+@receiver(post_delete, sender=Ingredient)
+def update_ingredient_recipes(sender, instance, **kwargs):
+    Recipe.objects.filter(id__in=getattr(instance, '_recipe_ids', ())).update(
+        ingredients_count=actual_count(IngredientRecipe, 'recipe'))
+    users = getattr(instance, '_shopping_users', None)
+    if users:
+        ShoppingListItem.objects.rebuild(users)
+
+
+def change_counter(model, pk, field, delta):
+    model.objects.filter(pk=pk).update(**{field: F(field) + delta})
+
+
+@receiver(post_save, sender=Favorites)
+def increment_favorites_count(sender, instance, created, **kwargs):
+    if created:
+        change_counter(Recipe, instance.recipe_id, 'favorites_count', 1)
+
+
+@receiver(post_delete, sender=Favorites)
+def decrement_favorites_count(sender, instance, **kwargs):
+    change_counter(Recipe, instance.recipe_id, 'favorites_count', -1)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def increment_in_carts_count(sender, instance, created, **kwargs):
+    if created:
+        change_counter(Recipe, instance.recipe_id, 'in_carts_count', 1)
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def decrement_in_carts_count(sender, instance, **kwargs):
+    change_counter(Recipe, instance.recipe_id, 'in_carts_count', -1)
+
+
+@receiver(post_save, sender=Recipe)
+def increment_recipes_count(sender, instance, created, **kwargs):
+    if created:
+        change_counter(CustomUser, instance.author_id, 'recipes_count', 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def decrement_recipes_count(sender, instance, **kwargs):
+    change_counter(CustomUser, instance.author_id, 'recipes_count', -1)
+
+
+@receiver(post_save, sender=Follow)
+def increment_followers_count(sender, instance, created, **kwargs):
+    if created:
+        change_counter(CustomUser, instance.author_id, 'followers_count', 1)
+
+
+@receiver(post_delete, sender=Follow)
+def decrement_followers_count(sender, instance, **kwargs):
+    change_counter(CustomUser, instance.author_id, 'followers_count', -1)